@@ -2,6 +2,7 @@
 import logging, re, ircTests, time
 from ircTests import IRCTest, TipoTest        
 from codes import codes
+from ircServer import Expectation
 
 class AdvancedTest(IRCTest):
     
@@ -13,10 +14,12 @@ class AdvancedTest(IRCTest):
 """
     Tests que comprueba el funcionamiento del comando AWAY
     
-    DEPENDENCIAS: - 
+    DEPENDENCIAS: Conexión y registro
 """
 class TestComandoAway(AdvancedTest):
     
+    dependencias = ["TestConexionRegistro"]
+    
     def _parseRPL_AWAYCommand(self, mensajes, awayMessage):
         
         # Comprobamos que hemos recibido el RPL_AWAY y que éste tiene
@@ -73,10 +76,12 @@ el servidor deberá incluir un código RPL_AWAY (301), incluyendo <mensaje>, en
 """
     Prueba que comprueba el modo de protección de topic de un canal
     
-    DEPENDENCIAS: - 
+    DEPENDENCIAS: Conexión y registro
 """
 class TestModoProteccionTopic(AdvancedTest):
-                
+    
+    dependencias = ["TestConexionRegistro"]
+    
     def execute(self):                       
          
         # Conexión al servidor        
@@ -120,10 +125,12 @@ el servidor debería responder con un código 482 (ERR_CHANOPRIVSNEEDED)."""
 """
     Prueba que comprueba el establecimiento de un canal secreto
     
-    DEPENDENCIAS: - 
+    DEPENDENCIAS: Conexión y registro
 """
 class TestModoCanalSecreto(AdvancedTest):
-                
+    
+    dependencias = ["TestConexionRegistro"]
+    
     def execute(self):                       
          
         # Conexión al servidor        
@@ -163,10 +170,12 @@ el servidor debería responder con un código 482 (ERR_CHANOPRIVSNEEDED)."""
 """
     Prueba que comprueba el modo de protección con clave de un canal
     
-    DEPENDENCIAS: - 
+    DEPENDENCIAS: Conexión y registro
 """
 class TestModoCanalProtegidoClave(AdvancedTest):
-                
+    
+    dependencias = ["TestConexionRegistro"]
+    
     def execute(self):                       
          
         # Conexión al servidor        
@@ -185,10 +194,14 @@ class TestModoCanalProtegidoClave(AdvancedTest):
         self.ircServer.send(self.testNick, "MODE #%s \+k %s" % (nuevoCanal, claveCanal))
         
         # 2. Ahora comprobamos que otro usuario, sin la clave
-        # correcta, no puede entrar en el canal
+        # correcta, no puede entrar en el canal. Esperamos a la vez el error
+        # y la confirmación del JOIN, para no esperar al timeout si el servidor
+        # deja entrar al usuario
         self.ircServer.connect(self.testNick2)
         self.ircServer.send(self.testNick2, "JOIN #%s"  % nuevoCanal)
-        self.ircServer.expect(self.testNick2, r":\S+ 475 %s #%s :\S+" % (self.testNick2, nuevoCanal))                
+        respuesta = Expectation([r":\S+ 475 %s #%s :\S+" % (self.testNick2, nuevoCanal),
+                                 r":\S+ JOIN :?#%s" % nuevoCanal]).wait(self.ircServer, [self.testNick2])
+        assert respuesta.index == 0, "El servidor ha permitido unirse al canal protegido #%s sin clave" % nuevoCanal
         
         # 3. Pero la puerta se abre con la clave correcta...                
         self.ircServer.joinChannel(self.testNick2, nuevoCanal, claveCanal)
@@ -208,9 +221,11 @@ es la adecuada."""
 """
     Tests que comprueba el funcionamiento del comando QUIT
     
-    DEPENDENCIAS: LIST 
+    DEPENDENCIAS: Conexión y registro
 """
 class TestComandoQuit(AdvancedTest):
+    
+    dependencias = ["TestConexionRegistro"]
                     
     def execute(self):                       
          
@@ -250,10 +265,12 @@ luego, cerrar el socket con el cliente"""
 """
     Tests que comprueba el funcionamiento del comando MOTD
     
-    DEPENDENCIAS: - 
+    DEPENDENCIAS: Conexión y registro
 """
 class TestComandoMOTD(AdvancedTest):
-                    
+    
+    dependencias = ["TestConexionRegistro"]
+    
     def execute(self):                       
          
         # Conexión al servidor        
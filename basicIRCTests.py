@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-import logging, ircparser, ircTests
+import logging, ircTests
 from ircTests import IRCTest, TipoTest
 from corrector import Corrector
 
@@ -19,6 +19,8 @@ class BasicTest(IRCTest):
 """
 class TestConexionRegistro(BasicTest):
     
+    sesionesReserva = False
+    
     def execute(self):        
                                 
         # Conexión al servidor
@@ -39,10 +41,13 @@ Para ello, envia los comandos USER y NICK, y parsea las respuestas."""
     Test que comprueba el comando JOIN. Necesita que LIST funcione correctamente para
     comprobar que el usuario se ha unido correctamente al canal.
     
-    DEPENDENCIAS: LIST 
+    DEPENDENCIAS: Conexión y registro. LIST (no se declara en dependencias, porque 
+    TestComandoList necesita a su vez que JOIN funcione y se ejecuta después)
 """
 class TestComandoJoin(BasicTest):
     
+    dependencias = ["TestConexionRegistro"]
+    
     def execute(self):                        
                 
         # Conexión al servidor
@@ -76,6 +81,8 @@ está en dicha lista, por lo que necesita que el comando LIST funcione correctam
 """
 class TestComandoList(BasicTest):
     
+    dependencias = ["TestComandoJoin"]
+    
     def execute(self):        
                 
         # Conexión al servidor        
@@ -120,6 +127,10 @@ class TestComandoList(BasicTest):
 """
 class TestComandoWhois(BasicTest):
     
+    dependencias = ["TestComandoJoin"]
+    # RPL_WHOISUSER devuelve los datos del USER con el que se registró el nick
+    sesionesReserva = False
+    
     def execute(self):                
 
         # Puntuación por los mensajes extra (+ 20%)
@@ -137,13 +148,12 @@ class TestComandoWhois(BasicTest):
         # Ahora enviamos el comando            
         self.ircServer.send(self.testNick, "WHOIS %s" % self.testNick)
                       
-        # Recepción y parseo de la respuesta                      
-        message = ircparser.translate(self.ircServer._readLine(self.testNick))                                       
-        
-        # TODO: Este bucle puede no terminar nunca, mejorar                 
-        # Hacer una función que devuelva una lista de 'message', con un límite máxmo
-        # de líneas leidas antes de dar ERROR
-        while (message['command'] is not "RPL_ENDOFWHOIS"):
+        # Recepción y parseo de la respuesta hasta RPL_ENDOFWHOIS (con timeout)
+        for entrada in self.ircServer.iterLinesTill(self.testNick, "RPL_ENDOFWHOIS"):
+            message = entrada.message
+            assert message is not None, "Se ha recibido una respuesta mal formada del servidor: %r" % entrada.line
+            if message['command'] == 'RPL_ENDOFWHOIS':
+                break
             # Cada mensaje que se muestre en la respuesta suma puntuación                
             if message['command'] == 'RPL_WHOISUSER':
                 localScore += extraScore                   
@@ -155,10 +165,8 @@ class TestComandoWhois(BasicTest):
                 assert "@#" + tempCanal in message['params'][2].split(' '),\
                     "Comando WHOIS no devuelve correctamente los canales en los que está el usuario"                
                 receivedMessages.append('RPL_WHOISCHANNELS')
-                
-            # Recepción y parseo de la respuesta                      
-            message = ircparser.translate(self.ircServer._readLine(self.testNick))            
-            assert message is not None, "Se ha recibido una respuesta vacía del servidor"
+        else:
+            raise AssertionError("No se ha recibido el código RPL_ENDOFWHOIS del servidor")
             
         # Comprobación de que se han recibido los mensajes correctos
         # Detección de duplicados
@@ -181,10 +189,12 @@ también los comandos RPL_WHOISUSER y RPL_WHOISSERVER (no son imprescindibles, p
 
 """
     INFO: Comprueba el funcionamiento del comando NAMES
-    DEPENDENCIAS: -
+    DEPENDENCIAS: Conexión y registro
 """
 class TestComandoNames(BasicTest):
     
+    dependencias = ["TestConexionRegistro"]
+    
     def execute(self):                
 
         # Conexión al servidor        
@@ -218,6 +228,8 @@ devuelta."""
 """
 class TestCambioNick(BasicTest):
     
+    dependencias = ["TestComandoNames"]
+    
     def execute(self):                
 
         # Conexión al servidor        
@@ -261,10 +273,12 @@ el nick de pruebas original."""
         1. Crea un canal de nombre y topic aleatorio, y comprueba que se han creado correctamente.
         2. Cambia el topic a otro valor, también aleatorio.
         3. Comprueba que el nuevo topic ha sido cambiado correctamente.
-    DEPENDENCIAS:
+    DEPENDENCIAS: Conexión y registro
 """
 class TestCambioTopic(BasicTest):
     
+    dependencias = ["TestConexionRegistro"]
+    
     def execute(self):                
 
         # Conexión al servidor
@@ -296,10 +310,12 @@ class TestCambioTopic(BasicTest):
         1. El operador del canal expulsa a un usuario
         2. Un usuario intenta expulsar a un operador, lo que debería fallar informando
         de que no se poseen privilegios suficientes
-    DEPENDENCIAS:
+    DEPENDENCIAS: Conexión y registro
 """
 class TestComandoKick(BasicTest):
     
+    dependencias = ["TestConexionRegistro"]
+    
     def execute(self):                
 
         # Necesitamos dos usuarios
@@ -346,6 +362,8 @@ class TestComandoKick(BasicTest):
 """
 class TestMensajePrivado(BasicTest):
     
+    dependencias = ["TestConexionRegistro"]
+    
     def execute(self):
         
         # Conexión de dos usuarios al servidor
@@ -374,6 +392,8 @@ aleatorios, que pueden no conectados a un canal"""
 """
 class TestMensajeACanal(BasicTest):
     
+    dependencias = ["TestConexionRegistro"]
+    
     def execute(self):
         
         # Conexión de tres usuarios al servidor y un canal aleatorio
@@ -409,6 +429,8 @@ aleatorios, que pueden no conectados a un canal"""
 """
 class TestPingPong(BasicTest):
     
+    dependencias = ["TestConexionRegistro"]
+    
     def execute(self):       
                  
         # Conexión de dos usuarios al servidor        
@@ -436,6 +458,8 @@ que debe ser respondido con un PONG y la misma cadena"""
 """
 class TestAbandonarCanal(BasicTest):
     
+    dependencias = ["TestComandoNames"]
+    
     def execute(self):       
                  
         # Conexión        
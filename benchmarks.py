@@ -0,0 +1,304 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""R2D2 - Benchmarks del parser IRC
+
+Mide el parseo (ircparser.translate en ambos sentidos, translate_lazy y el parser
+anterior basado en IRC_RE), la separación en líneas (readline, LineBuffer y
+translate_many) y las búsquedas en codes sobre un corpus de salida de servidor:
+ráfagas de bienvenida, respuestas LIST y NAMES, avalanchas de PRIVMSG y líneas
+mal formadas con NULs. De cada operación se da el tiempo por mensaje, los
+mensajes por segundo y los objetos contenedores que deja vivos por mensaje (no
+las asignaciones: los objetos temporales no se cuentan).
+
+El corpus se genera siempre igual, así que sirve para comparar versiones del
+parser. Con --guardar se escribe en un directorio, y con --traza se añade al
+corpus el contenido de un fichero con una línea recibida del servidor por línea
+(por ejemplo, uno de los guardados o una captura real). Las líneas en blanco de
+las trazas se ignoran.
+
+Usage:
+  benchmarks [--lineas <num_lineas>] [--repeticiones <num_repeticiones>] [--traza <fichero>...] [--guardar <directorio>]
+  benchmarks (-h | --help)
+
+Opciones:
+  -h --help                           Muestra esta pantalla de ayuda
+  --lineas <num_lineas>               Número de líneas de cada parte del corpus [default: 10000]
+  --repeticiones <num_repeticiones>   Se toma el mejor tiempo de estas repeticiones [default: 5]
+  --traza <fichero>                   Añade al corpus las líneas de este fichero
+  --guardar <directorio>              Guarda cada parte del corpus generado en <directorio>/<nombre>.txt
+"""
+import os, gc, sys, time, random, string, docopt, StringIO
+import ircparser, codes
+
+"""
+    ENTRADA: Línea recibida del servidor
+    SALIDA: Diccionario con el mensaje parseado
+    FUNCIÓN: Parser original con IRC_RE, como referencia para las comparaciones
+"""
+def translateRegex(line):
+    m = ircparser.IRC_RE.match(line.strip())
+
+    if not m:
+        return None
+
+    m = m.groupdict()
+    m["num_command"] = m["command"]
+    m["command"] = codes.numeric[m["command"]] if codes.numeric.has_key(m["command"]) else 0
+
+    m["params"] = m.pop("params1").split()
+    if m["params2"]:    m["params"] += [m["params2"][1:]]
+    m.pop("params2")
+
+    return m
+
+def randomString(longitud = 8):
+    return ''.join(random.choice(string.letters) for i in range(longitud))
+
+"""
+    SALIDA: Lista con las líneas de las ráfagas de bienvenida (registro, LUSERS y
+    MOTD) que recibe una sucesión de clientes, hasta numLineas líneas
+"""
+def corpusWelcome(numLineas):
+    lineas = []
+    while len(lineas) < numLineas:
+        nick = randomString(9)
+        lineas += [":irc.example.org 001 %s :Welcome to the Internet Relay Network %s!~%s@127.0.0.1" % (nick, nick, nick[:8]),
+                   ":irc.example.org 002 %s :Your host is irc.example.org, running version r2d2-1.0" % nick,
+                   ":irc.example.org 003 %s :This server was created Mon Oct 12 2026 at 10:00:00 UTC" % nick,
+                   ":irc.example.org 004 %s irc.example.org r2d2-1.0 aiwroOs biklmnopstv" % nick,
+                   ":irc.example.org 005 %s CHANTYPES=# PREFIX=(ov)@+ NICKLEN=9 :are supported by this server" % nick,
+                   ":irc.example.org 251 %s :There are %d users and 0 services on 1 server" % (nick, random.randint(1, 500)),
+                   ":irc.example.org 254 %s %d :channels formed" % (nick, random.randint(1, 100)),
+                   ":irc.example.org 255 %s :I have %d clients and 0 servers" % (nick, random.randint(1, 500)),
+                   ":irc.example.org 375 %s :- irc.example.org Message of the day - " % nick]
+        lineas += [":irc.example.org 372 %s :- %s" % (nick, " ".join(randomString() for j in range(8))) for i in range(10)]
+        lineas += [":irc.example.org 376 %s :End of MOTD command" % nick,
+                   ":%s MODE %s :+i" % (nick, nick)]
+    return lineas[:numLineas]
+
+"""
+    SALIDA: Lista con las líneas de una respuesta a LIST con numLineas canales
+"""
+def corpusList(numLineas):
+    lineas = [":irc.example.org 321 yoda Channel :Users Name"]
+    for i in range(numLineas):
+        lineas.append(":irc.example.org 322 yoda #%s %d :%s" %
+                      (randomString(), random.randint(1, 500), " ".join(randomString() for j in range(6))))
+    lineas.append(":irc.example.org 323 yoda :End of /LIST")
+    return lineas
+
+"""
+    SALIDA: Lista con las líneas de una respuesta a NAMES con numLineas líneas de 40 usuarios
+"""
+def corpusNames(numLineas):
+    lineas = []
+    for i in range(numLineas):
+        usuarios = " ".join(random.choice(["", "@", "+"]) + randomString(9) for j in range(40))
+        lineas.append(":irc.example.org 353 yoda = #canal :%s" % usuarios)
+    lineas.append(":irc.example.org 366 yoda #canal :End of /NAMES list")
+    return lineas
+
+"""
+    SALIDA: Lista con numLineas mensajes de usuarios a canales y a yoda, con algún NOTICE
+"""
+def corpusPrivmsg(numLineas):
+    usuarios = ["%s!~%s@%s.example.org" % (randomString(9), randomString(6), randomString(5)) for i in range(50)]
+    lineas = []
+    for i in range(numLineas):
+        destino = random.choice(["#canal", "#otro", "yoda"])
+        comando = "NOTICE" if random.random() < 0.1 else "PRIVMSG"
+        lineas.append(":%s %s %s :%s" % (random.choice(usuarios), comando, destino,
+                                         " ".join(randomString(random.randint(1, 10)) for j in range(random.randint(1, 15)))))
+    return lineas
+
+"""
+    SALIDA: Lista con numLineas líneas, la mitad válidas y la otra mitad mal formadas:
+    con NULs, sin comando, sólo con prefijo, con espacios de sobra, vacías...
+"""
+def corpusMalformed(numLineas):
+    malformadas = [lambda: ":irc.example.org NOTICE yoda :con\x00un NUL",
+                   lambda: "\x00\x00PING :%s" % randomString(),
+                   lambda: ":%s" % randomString(),
+                   lambda: ":%s PRIVMSG" % randomString(),
+                   lambda: "PING",
+                   lambda: ":!@ 001 yoda :prefijo vacío",
+                   lambda: ":%s!@host PRIVMSG yoda :sin usuario" % randomString(),
+                   lambda: "   :irc.example.org   322   yoda   #%s   3   :  espacios  " % randomString(),
+                   lambda: "",
+                   lambda: " ",
+                   lambda: ":irc.example.org 999 yoda :código desconocido",
+                   lambda: ":irc.example.org PRIVMSG yoda ::dos puntos: y \xff\xfe bytes"]
+    lineas = []
+    for i in range(numLineas):
+        if i % 2:
+            lineas.append(random.choice(malformadas)())
+        else:
+            lineas.append(":%s!u@h PRIVMSG #canal :%s" % (randomString(9), randomString(30)))
+    return lineas
+
+"""
+    ENTRADA: Número de líneas de cada parte, ficheros de trazas
+    SALIDA: Lista de tuplas (nombre, líneas) con las partes del corpus, sin líneas
+    en blanco en las trazas
+"""
+def buildCorpus(numLineas, trazas = ()):
+    corpus = [("bienvenida", corpusWelcome(numLineas)),
+              ("LIST", corpusList(numLineas)),
+              ("NAMES", corpusNames(numLineas)),
+              ("PRIVMSG", corpusPrivmsg(numLineas)),
+              ("malformado", corpusMalformed(numLineas))]
+    for traza in trazas:
+        with open(traza) as f:
+            lineas = [l.rstrip("\r\n") for l in f]
+        corpus.append((os.path.splitext(os.path.basename(traza))[0], [l for l in lineas if l.strip()]))
+    return corpus
+
+def saveCorpus(corpus, directorio):
+    if not os.path.isdir(directorio):
+        os.makedirs(directorio)
+    for nombre, lineas in corpus:
+        with open(os.path.join(directorio, nombre + ".txt"), "w") as f:
+            f.write("".join(linea + "\r\n" for linea in lineas))
+
+"""
+    ENTRADA: Función que procesa todo el corpus, sus datos, número de repeticiones
+    SALIDA: Mejor tiempo (en segundos) de una pasada
+"""
+def bestTime(operacion, datos, repeticiones):
+    mejor = None
+    for i in range(repeticiones):
+        inicio = time.time()
+        operacion(datos)
+        duracion = time.time() - inicio
+        mejor = duracion if mejor is None else min(mejor, duracion)
+    return mejor
+
+"""
+    ENTRADA: Función que procesa todo el corpus, sus datos
+    SALIDA: Número de objetos contenedores creados por la pasada que siguen vivos al
+    terminar
+    FUNCIÓN: Python 2 no tiene tracemalloc ni sys.getallocatedblocks, así que se usa
+    el contador de la generación 0 del recolector, que suma las creaciones y resta
+    las liberaciones de objetos contenedores (tuplas, listas, diccionarios,
+    instancias...). Es el saldo neto, no el número de asignaciones: los objetos
+    temporales que se liberan durante la pasada no aparecen, y las cadenas no se
+    cuentan. El resultado de la operación se mantiene vivo mientras se mide
+"""
+def retainedObjects(operacion, datos):
+    gc.collect()
+    gc.disable()
+    try:
+        antes = gc.get_count()[0]
+        resultado = operacion(datos)
+        despues = gc.get_count()[0]
+    finally:
+        gc.enable()
+    del resultado
+    return despues - antes
+
+"""
+    Operaciones a medir. Cada una recibe los datos preparados a partir de las
+    líneas del corpus (por defecto, las propias líneas) y los procesa todos
+"""
+def parseRegex(lineas):
+    return [translateRegex(linea) for linea in lineas]
+
+def parseTranslate(lineas):
+    return [ircparser.translate(linea) for linea in lineas]
+
+def discardLazy(lineas):
+    # Lo que hace un bucle de descarte con cada línea: parsearla y mirar el comando
+    comandos = []
+    for linea in lineas:
+        m = ircparser.translate_lazy(linea)
+        comandos.append(m['command'] if m is not None else None)
+    return comandos
+
+def toDicts(lineas):
+    mensajes = [ircparser.translate(linea) for linea in lineas]
+    return [dict(m.items(), command = m.num_command) for m in mensajes if m is not None]
+
+def serializeTranslate(mensajes):
+    return [ircparser.translate(m) for m in mensajes]
+
+def serializeMany(mensajes):
+    return ircparser.encode_many(mensajes)
+
+def toBuffer(lineas):
+    return "".join(linea + "\r\n" for linea in lineas)
+
+def toChunks(lineas):
+    # Trozos del tamaño de las lecturas del receptor, cortando líneas por la mitad
+    buffer = toBuffer(lineas)
+    return [buffer[i:i + 16384] for i in range(0, len(buffer), 16384)]
+
+def frameReadline(buffer):
+    return StringIO.StringIO(buffer).readlines()
+
+def parseReadline(buffer):
+    return [ircparser.translate(linea) for linea in StringIO.StringIO(buffer)]
+
+def frameLineBuffer(trozos):
+    buffer = ircparser.LineBuffer(16384)
+    lineas = []
+    for trozo in trozos:
+        buffer.feed(trozo)
+        lineas += buffer.take().split("\n")
+        lineas.pop()
+    return lineas
+
+def parseMany(trozos):
+    return list(ircparser.translate_stream(trozos))
+
+def toCommands(lineas):
+    return [m.num_command for m in (ircparser.translate(linea) for linea in lineas) if m is not None]
+
+def lookupNumeric(comandos):
+    numeric = codes.numeric
+    return [numeric.get(comando, 0) for comando in comandos]
+
+def lookupNames(comandos):
+    nombre = codes.name
+    return [nombre(comando) for comando in comandos]
+
+# (nombre, preparación de los datos o None, operación)
+OPERACIONES = [("IRC_RE", None, parseRegex),
+               ("translate", None, parseTranslate),
+               ("translate_lazy", None, discardLazy),
+               ("serializar", toDicts, serializeTranslate),
+               ("encode_many", toDicts, serializeMany),
+               ("lineas readline", toBuffer, frameReadline),
+               ("lineas LineBuffer", toChunks, frameLineBuffer),
+               ("parseo readline", toBuffer, parseReadline),
+               ("parseo por trozos", toChunks, parseMany),
+               ("codes.numeric", toCommands, lookupNumeric),
+               ("codes.name", toCommands, lookupNames)]
+
+def benchmarkParser(corpus, repeticiones):
+    print "%-12s %-18s %10s %12s %11s" % ("Corpus", "Operación", "us/msg", "msg/s", "vivos/msg")
+    for nombre, lineas in corpus:
+        # Ambos parsers deben dar el mismo resultado
+        for linea in lineas:
+            assert ircparser.translate(linea) == translateRegex(linea), linea
+
+        for operacion, preparar, ejecutar in OPERACIONES:
+            datos = preparar(lineas) if preparar else lineas
+            duracion = bestTime(ejecutar, datos, repeticiones)
+            objetos = retainedObjects(ejecutar, datos)
+            print "%-12s %-18s %10.2f %12.0f %11.2f" % (nombre, operacion, duracion * 1e6 / len(lineas),
+                                                        len(lineas) / duracion if duracion else float("inf"),
+                                                        float(objetos) / len(lineas))
+        print
+
+if __name__ == "__main__":
+    arguments = docopt.docopt(__doc__, help = True)
+    random.seed(0)
+    corpus = buildCorpus(int(arguments['--lineas']), arguments['--traza'])
+    # Las medidas se dan por mensaje, así que no se admiten partes vacías
+    vacias = [nombre for nombre, lineas in corpus if not lineas]
+    if vacias:
+        sys.exit("ERROR: No hay líneas que medir en: %s (usa --lineas mayor que 0 y trazas "
+                 "con alguna línea no vacía)" % ", ".join(vacias))
+    if arguments['--guardar']:
+        saveCorpus(corpus, arguments['--guardar'])
+    benchmarkParser(corpus, int(arguments['--repeticiones']))
@@ -1,115 +1,116 @@
-# Numeric table based on the Perl's Net::IRC.
+# Numeric table based on the Perl's Net::IRC, with the names normalized to the
+# RFC 1459/2812 ones (RPL_* for replies, ERR_* for errors).
 numeric = {
-    "001": "welcome",
-    "002": "yourhost",
-    "003": "created",
-    "004": "myinfo",
-    "005": "featurelist",  # XXX
-    "200": "tracelink",
-    "201": "traceconnecting",
-    "202": "tracehandshake",
-    "203": "traceunknown",
-    "204": "traceoperator",
-    "205": "traceuser",
-    "206": "traceserver",
-    "207": "traceservice",
-    "208": "tracenewtype",
-    "209": "traceclass",
-    "210": "tracereconnect",
-    "211": "statslinkinfo",
-    "212": "statscommands",
-    "213": "statscline",
-    "214": "statsnline",
-    "215": "statsiline",
-    "216": "statskline",
-    "217": "statsqline",
-    "218": "statsyline",
-    "219": "endofstats",
-    "221": "umodeis",
-    "231": "serviceinfo",
-    "232": "endofservices",
-    "233": "service",
-    "234": "servlist",
-    "235": "servlistend",
-    "241": "statslline",
-    "242": "statsuptime",
-    "243": "statsoline",
-    "244": "statshline",
-    "250": "luserconns",
-    "251": "luserclient",
-    "252": "luserop",
-    "253": "luserunknown",
-    "254": "luserchannels",
-    "255": "luserme",
-    "256": "adminme",
-    "257": "adminloc1",
-    "258": "adminloc2",
-    "259": "adminemail",
-    "261": "tracelog",
-    "262": "endoftrace",
-    "263": "tryagain",
-    "265": "n_local",
-    "266": "n_global",
-    "300": "none",
+    "001": "RPL_WELCOME",
+    "002": "RPL_YOURHOST",
+    "003": "RPL_CREATED",
+    "004": "RPL_MYINFO",
+    "005": "RPL_ISUPPORT",  # XXX
+    "200": "RPL_TRACELINK",
+    "201": "RPL_TRACECONNECTING",
+    "202": "RPL_TRACEHANDSHAKE",
+    "203": "RPL_TRACEUNKNOWN",
+    "204": "RPL_TRACEOPERATOR",
+    "205": "RPL_TRACEUSER",
+    "206": "RPL_TRACESERVER",
+    "207": "RPL_TRACESERVICE",
+    "208": "RPL_TRACENEWTYPE",
+    "209": "RPL_TRACECLASS",
+    "210": "RPL_TRACERECONNECT",
+    "211": "RPL_STATSLINKINFO",
+    "212": "RPL_STATSCOMMANDS",
+    "213": "RPL_STATSCLINE",
+    "214": "RPL_STATSNLINE",
+    "215": "RPL_STATSILINE",
+    "216": "RPL_STATSKLINE",
+    "217": "RPL_STATSQLINE",
+    "218": "RPL_STATSYLINE",
+    "219": "RPL_ENDOFSTATS",
+    "221": "RPL_UMODEIS",
+    "231": "RPL_SERVICEINFO",
+    "232": "RPL_ENDOFSERVICES",
+    "233": "RPL_SERVICE",
+    "234": "RPL_SERVLIST",
+    "235": "RPL_SERVLISTEND",
+    "241": "RPL_STATSLLINE",
+    "242": "RPL_STATSUPTIME",
+    "243": "RPL_STATSOLINE",
+    "244": "RPL_STATSHLINE",
+    "250": "RPL_STATSCONN",
+    "251": "RPL_LUSERCLIENT",
+    "252": "RPL_LUSEROP",
+    "253": "RPL_LUSERUNKNOWN",
+    "254": "RPL_LUSERCHANNELS",
+    "255": "RPL_LUSERME",
+    "256": "RPL_ADMINME",
+    "257": "RPL_ADMINLOC1",
+    "258": "RPL_ADMINLOC2",
+    "259": "RPL_ADMINEMAIL",
+    "261": "RPL_TRACELOG",
+    "262": "RPL_TRACEEND",
+    "263": "RPL_TRYAGAIN",
+    "265": "RPL_LOCALUSERS",
+    "266": "RPL_GLOBALUSERS",
+    "300": "RPL_NONE",
     "301": "RPL_AWAY",
-    "302": "userhost",
-    "303": "ison",
+    "302": "RPL_USERHOST",
+    "303": "RPL_ISON",
     "305": "RPL_UNAWAY",
     "306": "RPL_NOWAWAY",
     "311": "RPL_WHOISUSER",
     "312": "RPL_WHOISSERVER",
     "313": "RPL_WHOISOPERATOR",
-    "314": "whowasuser",
-    "315": "endofwho",
-    "316": "whoischanop",
+    "314": "RPL_WHOWASUSER",
+    "315": "RPL_ENDOFWHO",
+    "316": "RPL_WHOISCHANOP",
     "317": "RPL_WHOISIDLE",
     "318": "RPL_ENDOFWHOIS",
     "319": "RPL_WHOISCHANNELS",
-    "321": "liststart",
+    "321": "RPL_LISTSTART",
     "322": "RPL_LIST",
     "323": "RPL_LISTEND",
-    "324": "channelmodeis",
-    "329": "channelcreate",
-    "330": "whoisaccount", # <nick> <accountName> :<info> - Spawned from a /whois
+    "324": "RPL_CHANNELMODEIS",
+    "329": "RPL_CREATIONTIME",
+    "330": "RPL_WHOISACCOUNT", # <nick> <accountName> :<info> - Spawned from a /whois
     "331": "RPL_NOTOPIC",
     "332": "RPL_TOPIC",
-    "333": "topicinfo",
-    "341": "inviting",
-    "342": "summoning",
-    "346": "invitelist",
-    "347": "endofinvitelist",
-    "348": "exceptlist",
-    "349": "endofexceptlist",
-    "351": "version",
-    "352": "whoreply",
+    "333": "RPL_TOPICWHOTIME",
+    "341": "RPL_INVITING",
+    "342": "RPL_SUMMONING",
+    "346": "RPL_INVITELIST",
+    "347": "RPL_ENDOFINVITELIST",
+    "348": "RPL_EXCEPTLIST",
+    "349": "RPL_ENDOFEXCEPTLIST",
+    "351": "RPL_VERSION",
+    "352": "RPL_WHOREPLY",
     "353": "RPL_NAMREPLY",
-    "354": "whospcrpl", # Response to a WHOX query
-    "361": "killdone",
-    "362": "closing",
-    "363": "closeend",
-    "364": "links",
-    "365": "endoflinks",
+    "354": "RPL_WHOSPCRPL", # Response to a WHOX query
+    "361": "RPL_KILLDONE",
+    "362": "RPL_CLOSING",
+    "363": "RPL_CLOSEEND",
+    "364": "RPL_LINKS",
+    "365": "RPL_ENDOFLINKS",
     "366": "RPL_ENDOFNAMES",
-    "367": "banlist",
-    "368": "endofbanlist",
-    "369": "endofwhowas",
-    "371": "info",
+    "367": "RPL_BANLIST",
+    "368": "RPL_ENDOFBANLIST",
+    "369": "RPL_ENDOFWHOWAS",
+    "371": "RPL_INFO",
     "372": "RPL_MOTD",
-    "373": "infostart",
-    "374": "endofinfo",
+    "373": "RPL_INFOSTART",
+    "374": "RPL_ENDOFINFO",
     "375": "RPL_MOTDSTART",
     "376": "RPL_ENDOFMOTD",
-    "377": "motd2",        # 1997-10-16 -- tkil
+    "377": "RPL_MOTD2",        # 1997-10-16 -- tkil
     "378": "RPL_WHOISHOST",
     "379": "RPL_WHOISMODES",
-    "381": "youreoper",
-    "382": "rehashing",
-    "384": "myportis",
-    "391": "time",
-    "392": "usersstart",
-    "393": "users",
-    "394": "endofusers",
-    "395": "nousers",
+    "381": "RPL_YOUREOPER",
+    "382": "RPL_REHASHING",
+    "384": "RPL_MYPORTIS",
+    "391": "RPL_TIME",
+    "392": "RPL_USERSSTART",
+    "393": "RPL_USERS",
+    "394": "RPL_ENDOFUSERS",
+    "395": "RPL_NOUSERS",
     "401": "ERR_NOSUCHNICK",
     "402": "ERR_NOSUCHSERVER",
     "403": "ERR_NOSUCHCHANNEL",
@@ -118,7 +119,7 @@ numeric = {
     "406": "ERR_WASNOSUCHNICK",
     "407": "ERR_TOOMANYTARGETS",
     "409": "ERR_NOORIGIN",
-    "410": "invalidcapcmd",
+    "410": "ERR_INVALIDCAPCMD",
     "411": "ERR_NORECIPIENT",
     "412": "ERR_NOTEXTTOSEND",
     "413": "ERR_NOTOPLEVEL",
@@ -128,46 +129,77 @@ numeric = {
     "423": "ERR_NOADMININFO",
     "424": "ERR_FILEERROR",
     "431": "ERR_NONICKNAMEGIVEN",
-    "432": "erroneusnickname",  # Thiss iz how its speld in thee RFC.
-    "433": "nicknameinuse",
-    "436": "nickcollision",
-    "437": "unavailresource",  # "Nick temporally unavailable"
-    "441": "usernotinchannel",
-    "442": "notonchannel",
-    "443": "useronchannel",
-    "444": "nologin",
-    "445": "summondisabled",
-    "446": "usersdisabled",
-    "451": "notregistered",
+    "432": "ERR_ERRONEUSNICKNAME",  # Thiss iz how its speld in thee RFC.
+    "433": "ERR_NICKNAMEINUSE",
+    "436": "ERR_NICKCOLLISION",
+    "437": "ERR_UNAVAILRESOURCE",  # "Nick temporally unavailable"
+    "441": "ERR_USERNOTINCHANNEL",
+    "442": "ERR_NOTONCHANNEL",
+    "443": "ERR_USERONCHANNEL",
+    "444": "ERR_NOLOGIN",
+    "445": "ERR_SUMMONDISABLED",
+    "446": "ERR_USERSDISABLED",
+    "451": "ERR_NOTREGISTERED",
     "461": "ERR_NEEDMOREPARAMS",
-    "462": "alreadyregistered",
-    "463": "nopermforhost",
-    "464": "passwdmismatch",
-    "465": "yourebannedcreep",  # I love this one...
-    "466": "youwillbebanned",
-    "467": "keyset",
-    "471": "channelisfull",
-    "472": "unknownmode",
-    "473": "inviteonlychan",
-    "474": "bannedfromchan",
-    "475": "badchannelkey",
-    "476": "badchanmask",
-    "477": "nochanmodes",  # "Channel doesn't support modes"
-    "478": "banlistfull",
-    "480": "cannotknock", #generated when /knock <chan> is ran on a channel that you are either in or has /knock'ing disabled
-    "481": "noprivileges",
+    "462": "ERR_ALREADYREGISTRED",
+    "463": "ERR_NOPERMFORHOST",
+    "464": "ERR_PASSWDMISMATCH",
+    "465": "ERR_YOUREBANNEDCREEP",  # I love this one...
+    "466": "ERR_YOUWILLBEBANNED",
+    "467": "ERR_KEYSET",
+    "471": "ERR_CHANNELISFULL",
+    "472": "ERR_UNKNOWNMODE",
+    "473": "ERR_INVITEONLYCHAN",
+    "474": "ERR_BANNEDFROMCHAN",
+    "475": "ERR_BADCHANNELKEY",
+    "476": "ERR_BADCHANMASK",
+    "477": "ERR_NOCHANMODES",  # "Channel doesn't support modes"
+    "478": "ERR_BANLISTFULL",
+    "480": "ERR_CANNOTKNOCK", #generated when /knock <chan> is ran on a channel that you are either in or has /knock'ing disabled
+    "481": "ERR_NOPRIVILEGES",
     "482": "ERR_CHANOPRIVSNEEDED",
-    "483": "cantkillserver",
-    "484": "restricted",   # Connection is restricted
-    "485": "uniqopprivsneeded",
-    "491": "nooperhost",
-    "492": "noservicehost",
-    "501": "umodeunknownflag",
-    "502": "usersdontmatch",
+    "483": "ERR_CANTKILLSERVER",
+    "484": "ERR_RESTRICTED",   # Connection is restricted
+    "485": "ERR_UNIQOPPRIVSNEEDED",
+    "491": "ERR_NOOPERHOST",
+    "492": "ERR_NOSERVICEHOST",
+    "501": "ERR_UMODEUNKNOWNFLAG",
+    "502": "ERR_USERSDONTMATCH",
 }
 
 codes = dict((v, k) for k, v in numeric.items())
 
+# Table generated from numeric and indexed by the integer code: names[332] is
+# "RPL_TOPIC", and None for the codes without a name. numbers is the reverse
+# mapping, from the name to the integer code. Both point to the same string
+# objects as numeric, so the names can still be compared with "is".
+names = [None] * 1000
+for _code, _name in numeric.items():
+    names[int(_code)] = _name
+del _code, _name
+
+numbers = dict((name, code) for code, name in enumerate(names) if name is not None)
+
+def is_numeric(command):
+    """ True if command is a numeric reply: three digits, as sent by the server. """
+    return len(command) == 3 and command.isdigit()
+
+def code(command):
+    """ Integer code of a numeric reply ("332" -> 332), or None if it is not numeric. """
+    return int(command) if len(command) == 3 and command.isdigit() else None
+
+def name(code):
+    """ Name of a numeric code, given as an int or as a 3-digit string, or None. """
+    if not isinstance(code, int):
+        if not is_numeric(code):
+            return None
+        code = int(code)
+    return names[code] if 0 <= code < 1000 else None
+
+def number(name):
+    """ Integer code of a reply name ("RPL_TOPIC" -> 332), or None. """
+    return numbers.get(name)
+
 generated = [
     "dcc_connect",
     "dcc_disconnect",
@@ -1,7 +1,7 @@
 #! /usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import subprocess, psutil, os.path, re, tarfile, logging, csv
+import subprocess, os.path, re, tarfile, logging, csv
 from subprocess import PIPE
 from termcolor import colored
 
@@ -141,6 +141,7 @@ class Corrector(object):
         assert self.checkFicheroAutores(rutaFicheroAutores), "Formato del fichero de autores incorrecto"                                                                                                                                                        
     
     def _mataServidor (self, nombreServidor):   
+        import psutil
              
         for proc in psutil.process_iter():
         # check whether the process name matches
@@ -157,6 +158,8 @@ class Corrector(object):
         DEVUELVE: -
     """
     def corrigePracticas(self, dirEntrada):        
+        # psutil sólo hace falta para la corrección masiva, no para el resto de pruebas
+        import psutil
         
         try:
             print "Corrigiendo prácticas en [%s]..." %  dirEntrada
@@ -226,6 +229,7 @@ class Corrector(object):
                     continue
                 
                 serverPID = p.pid
+                self.sd.serverPid = serverPID
                 print "OK. PID [%s]" % serverPID                                 
             
                 # 7. Ejecutamos los tests
@@ -2,6 +2,7 @@
 import logging, re, ircTests
 from ircTests import IRCTest, TipoTest        
 from codes import codes
+from ircServer import Expectation
 
 class AdvancedTest(IRCTest):
     
@@ -17,6 +18,8 @@ class AdvancedTest(IRCTest):
 """
 class TestAbandonarCanalInexistente(AdvancedTest):
     
+    dependencias = ["TestComandoList"]
+    
     def execute(self):                       
          
         # Conexión        
@@ -47,6 +50,8 @@ cuando se intenta abandonar un canal inexistente"""
 """
 class TestJoinSinArgumentos(AdvancedTest):
     
+    dependencias = ["TestComandoList"]
+    
     def execute(self):                       
          
         # Conexión al servidor        
@@ -66,8 +71,15 @@ class TestJoinSinArgumentos(AdvancedTest):
         return """Realiza el envio de un comando JOIN malformado (sin argumentos), y 
 comprueba que el servidor reacciona correctamente"""            
             
+"""
+    Envía un comando WHOIS sin nick, que el servidor debería rechazar con el código
+    ERR_NONICKNAMEGIVEN
+    DEPENDENCIAS: Conexión y registro
+"""
 class TestComandoWhoisSinNick(AdvancedTest):
     
+    dependencias = ["TestConexionRegistro"]
+    
     def execute(self):                
         
         self.ircServer.connect(self.testNick)
@@ -94,6 +106,8 @@ del servidor debería incluir el código de error ERR_NONICKNAMEGIVEN."""
 """
 class TestNoTopic(AdvancedTest):
     
+    dependencias = ["TestConexionRegistro"]
+    
     def execute(self):                
 
         # Conexión al servidor        
@@ -119,8 +133,15 @@ class TestNoTopic(AdvancedTest):
 servidor debería devolver el código 331 (No topic is set)"""   
         
 
+"""
+    Envía un mensaje privado a un usuario inexistente, que el servidor debería 
+    rechazar con el código de error apropiado
+    DEPENDENCIAS: Conexión y registro
+"""
 class TestMensajePrivadoANadie(AdvancedTest):
     
+    dependencias = ["TestConexionRegistro"]
+    
     def execute(self):
         
         # Conexión de dos usuarios al servidor
@@ -142,8 +163,15 @@ class TestMensajePrivadoANadie(AdvancedTest):
 " y devuelve el código de error apropiado"""         
                     
     
+"""
+    Envía ráfagas de comandos encadenados (JOIN a varios canales y mensajes) que el
+    servidor recibe en una misma lectura
+    DEPENDENCIAS: Conexión y registro
+"""
 class TestPruebaEstres(AdvancedTest):
     
+    dependencias = ["TestConexionRegistro"]
+    
     def execute(self):                
                     
         # Conectamos dos usuarios
@@ -167,6 +195,29 @@ class TestPruebaEstres(AdvancedTest):
             nuevoMensaje = self.ircServer.generateRandomString()
             
             self.ircServer.sendMessageToChannel(self.testNick, [self.testNick2], nuevoCanal, nuevoMensaje)                            
+        
+        # Repetimos encadenando los comandos: el servidor recibe cada tanda en 
+        # una sola escritura y debe procesar todos los comandos, en orden
+        canales = [self.ircServer.generateRandomString() for i in range(0,10)]
+        with self.ircServer.batch():
+            for canal in canales:
+                self.ircServer.send(self.testNick, "JOIN #%s" % canal)
+        Expectation([r":\S+ JOIN :#%s" % canal for canal in canales], 
+                    Expectation.ALL, ordenado = True).wait(self.ircServer, [self.testNick])
+        self.ircServer.discardAll(self.testNick)
+        
+        mensajes = [self.ircServer.generateRandomString() for i in range(0,100)]
+        with self.ircServer.batch():
+            for mensaje in mensajes:
+                self.ircServer.send(self.testNick, "PRIVMSG %s :%s" % (self.testNick2, mensaje))
+        Expectation([r":\S+ PRIVMSG %s :%s" % (self.testNick2, mensaje) for mensaje in mensajes], 
+                    Expectation.ALL, ordenado = True).wait(self.ircServer, [self.testNick2])
+        
+        with self.ircServer.batch():
+            for mensaje in mensajes:
+                self.ircServer.send(self.testNick, "PRIVMSG #%s :%s" % (nuevoCanal, mensaje))
+        Expectation([r":\S+ PRIVMSG #%s :%s" % (nuevoCanal, mensaje) for mensaje in mensajes], 
+                    Expectation.ALL, ordenado = True).wait(self.ircServer, [self.testNick2])
                                     
         # Todo ha ido bien
         return self.getScore()                                
@@ -176,7 +227,9 @@ class TestPruebaEstres(AdvancedTest):
         
     def getInfo(self):
         return """Realiza una prueba de estrés al servidor, enviando muy rápidamente multitud de
-mensajes privados a un usuario, y a un canal general"""         
+mensajes privados a un usuario, y a un canal general. Después repite el envío 
+encadenando los comandos (JOIN a varios canales y mensajes), de forma que el servidor 
+recibe muchos comandos en una misma lectura"""         
         
 
 """
@@ -186,6 +239,8 @@ mensajes privados a un usuario, y a un canal general"""
 """
 class TestComandoDesconocido(AdvancedTest):
     
+    dependencias = ["TestConexionRegistro"]
+    
     def execute(self):                
             
         # Conexión con el servidor
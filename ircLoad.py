@@ -0,0 +1,559 @@
+# -*- coding: utf-8 -*-
+import sys, time, random, socket, select, errno, threading, logging
+from termcolor import colored
+import ircparser, ircStats
+from ircServer import IRCServer
+
+"""
+    Generador de carga. TestPruebaEstres manda 100 mensajes de un usuario a otro,
+    esperando cada uno antes de enviar el siguiente; aquí se conectan muchos
+    clientes a la vez, se reparten entre varios canales y se envía PRIVMSG a un
+    ritmo fijo (mensajes por segundo) durante un tiempo, mezclando mensajes
+    privados y a canales. Cada mensaje lleva un número de secuencia, con el que el
+    receptor busca su instante de envío y calcula la latencia de entrega.
+
+    Todo se hace desde un único hilo con un ircparser.Selector: en cada tick se
+    envían los mensajes que tocan según el tiempo transcurrido, agrupados por
+    conexión, y hasta el siguiente tick se lee lo que haya llegado. Si el servidor
+    no da abasto, el ritmo conseguido queda por debajo del objetivo y las
+    latencias crecen, que es justo lo que se quiere ver
+"""
+class LoadGenerator(object):
+
+    TICK = 0.01
+    # Tiempo máximo que se esperan las entregas pendientes al terminar de enviar
+    ESPERA_FINAL = 5
+
+    def __init__(self, sDroid, clientes = 100, canales = 10, tasa = 1000, tamano = 64, duracion = 10, privados = 0.5):
+        assert clientes >= 2, "Hacen falta al menos dos clientes"
+        assert 0 <= privados <= 1, "La fracción de mensajes privados debe estar entre 0 y 1"
+        assert canales > 0 or privados == 1, "Sin canales todos los mensajes deben ser privados"
+        self.sd = sDroid
+        self.clientes = clientes
+        self.canales = canales
+        self.tasa = tasa
+        self.tamano = tamano
+        self.duracion = duracion
+        self.privados = privados
+
+    """
+        SALIDA: Diccionario con los resultados, que además se muestran por pantalla
+        FUNCIÓN: Conecta los clientes, los une a los canales, genera la carga y
+             espera a las entregas pendientes
+    """
+    def run(self):
+        ircServer = IRCServer(self.sd)
+        print colored("Conectando %d clientes..." % self.clientes, 'green')
+        sys.stdout.flush()
+        conexiones = ircServer.connectBulk(self.clientes, timeout = 60 + self.clientes // 100)
+        try:
+            self.nicks = sorted(conexiones)
+            canalesDe = self._joinChannels(ircServer, conexiones)
+            ircServer.drainBulk(next(iter(conexiones.values())).selector, 0.5)
+
+            print colored("Generando carga durante %d s..." % self.duracion, 'green')
+            sys.stdout.flush()
+            resultados = self.generate(conexiones, canalesDe)
+        finally:
+            ircServer.closeBulk(conexiones)
+        self.showReport(resultados)
+        return resultados
+
+    """
+        ENTRADA: Diccionario nick -> ircparser.Connection de clientes ya registrados (todos en
+             el mismo Selector), diccionario nick -> canales en los que está cada uno,
+             función a la que se pasa (conn, mensaje) con cada mensaje recibido que no
+             es de la carga
+        SALIDA: Diccionario con los resultados, sin mostrarlos
+        FUNCIÓN: Genera la carga con unas conexiones que ya existen, como las de una 
+             prueba que prepara antes su escenario
+    """
+    def generate(self, conexiones, canalesDe, observador = None):
+        self.conexiones = conexiones
+        self.nicks = sorted(conexiones)
+        self.nickDe = dict((conn, nick) for nick, conn in conexiones.items())
+        self.canalesDe = dict((nick, list(canalesDe.get(nick, ()))) for nick in self.nicks)
+        self.miembros = {}
+        for nick, canales in self.canalesDe.items():
+            for canal in canales:
+                self.miembros.setdefault(canal, []).append(nick)
+        return self._generate(observador)
+
+    """
+        FUNCIÓN: Reparte los clientes entre los canales de forma circular: con más
+             clientes que canales cada canal tiene varios miembros, y con más canales
+             que clientes cada cliente está en varios canales
+    """
+    def _joinChannels(self, ircServer, conexiones):
+        canalesDe = dict((nick, []) for nick in self.nicks)
+        if not self.canales:
+            return canalesDe
+        prefijo = ircServer.generateRandomString()[:6]
+        for i in range(max(self.canales, self.clientes)):
+            canal = "#%s%d" % (prefijo, i % self.canales)
+            canalesDe[self.nicks[i % self.clientes]].append(canal)
+        inicio = time.time()
+        ircServer.joinBulk(conexiones, canalesDe, timeout = 120)
+        logging.info("JOIN: %d clientes en %d canales en %.2f s" % (self.clientes, self.canales, time.time() - inicio))
+        return canalesDe
+
+    """
+        SALIDA: Tupla (nick emisor, destino, número de entregas esperadas, es privado)
+    """
+    def _pick(self):
+        emisor = random.choice(self.nicks)
+        if random.random() < self.privados or not self.canalesDe[emisor]:
+            destino = random.choice(self.nicks)
+            while destino == emisor:
+                destino = random.choice(self.nicks)
+            return emisor, destino, 1, True
+        canal = random.choice(self.canalesDe[emisor])
+        return emisor, canal, len(self.miembros[canal]) - 1, False
+
+    def _generate(self, observador = None):
+        selector = next(iter(self.conexiones.values())).selector
+        relleno = "x" * self.tamano
+        # Marca de esta carga, para no confundir sus mensajes con los de otra anterior
+        marca = "".join(random.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for i in range(4))
+        enviados = []           # instante de envío de cada número de secuencia
+        privado = []            # si cada mensaje era privado
+        latenciasPrivados, latenciasCanal = [], []
+        esperadas = recibidas = 0
+        errores = {}
+        cerradas = set()
+
+        inicio = ircStats.monotonic()
+        fin = inicio + self.duracion
+        ultimaEntrega = inicio
+        ahora = inicio
+        while True:
+            enviando = ahora < fin
+            if enviando:
+                # Mensajes que tocan según el tiempo transcurrido, agrupados por conexión
+                debidos = int((ahora - inicio) * self.tasa) - len(enviados)
+                salida = {}
+                for i in range(debidos):
+                    emisor, destino, entregas, esPrivado = self._pick()
+                    if emisor in cerradas:
+                        continue
+                    numero = "%s%d" % (marca, len(enviados))
+                    texto = ("%s %s" % (numero, relleno))[:max(self.tamano, len(numero))]
+                    salida.setdefault(self.conexiones[emisor], []).append({"command": "PRIVMSG", "params": [destino, texto]})
+                    enviados.append(ahora)
+                    privado.append(esPrivado)
+                    esperadas += entregas
+                for conn, mensajes in salida.items():
+                    conn.send_many(mensajes)
+            elif recibidas >= esperadas or ahora - ultimaEntrega > self.ESPERA_FINAL:
+                break
+
+            for conn in selector.wait(self.TICK):
+                llegada = ircStats.monotonic()
+                while conn.messages:
+                    message = conn.messages.popleft()
+                    comando = message.num_command
+                    if comando == "PRIVMSG":
+                        numero = message.params[-1].split(" ", 1)[0][len(marca):]
+                        if message.params[-1].startswith(marca) and numero.isdigit() and int(numero) < len(enviados):
+                            secuencia = int(numero)
+                            latencia = llegada - enviados[secuencia]
+                            (latenciasPrivados if privado[secuencia] else latenciasCanal).append(latencia)
+                            recibidas += 1
+                            ultimaEntrega = llegada
+                    elif comando == "PING":
+                        conn.pong(*message.params)
+                    elif message.code is not None and message.code >= 400:
+                        errores[comando] = errores.get(comando, 0) + 1
+                    elif observador is not None:
+                        observador(conn, message)
+                if conn.closed:
+                    selector.unregister(conn)
+                    cerradas.add(self.nickDe[conn])
+            ahora = ircStats.monotonic()
+
+        duracionReal = min(ahora, fin) - inicio
+        return {"enviados": len(enviados),
+                "duracion": duracionReal,
+                "tasaEnviada": len(enviados) / max(duracionReal, 1e-6),
+                "esperadas": esperadas,
+                "recibidas": recibidas,
+                "tasaEntregas": recibidas / max(ultimaEntrega - inicio, 1e-6),
+                "latenciasPrivados": latenciasPrivados,
+                "latenciasCanal": latenciasCanal,
+                "errores": errores,
+                "cerradas": len(cerradas)}
+
+    def showReport(self, resultados):
+        print
+        print colored("Resultados de la carga", 'green')
+        print colored("----------------------", 'green')
+        print "Clientes: %d, canales: %d, tamaño: %d bytes, privados: %d%%" % \
+            (self.clientes, self.canales, self.tamano, self.privados * 100)
+        print "Enviados: %d mensajes en %.1f s (%.0f msg/s de %d objetivo)" % \
+            (resultados["enviados"], resultados["duracion"], resultados["tasaEnviada"], self.tasa)
+        perdidas = resultados["esperadas"] - resultados["recibidas"]
+        print "Entregas: %d de %d esperadas (%.0f entregas/s)" % \
+            (resultados["recibidas"], resultados["esperadas"], resultados["tasaEntregas"]),
+        print colored("[%d PERDIDAS]" % perdidas, 'red') if perdidas else colored("[OK]", 'green')
+        if resultados["errores"]:
+            print colored("Errores del servidor: %s" % ", ".join("%s x%d" % e for e in sorted(resultados["errores"].items())), 'red')
+        if resultados["cerradas"]:
+            print colored("El servidor ha cerrado %d conexiones" % resultados["cerradas"], 'red')
+
+        print
+        print "%-10s %10s %10s %10s %10s %10s" % ("Latencia", "entregas", "p50 (ms)", "p95 (ms)", "p99 (ms)", "max (ms)")
+        for nombre, latencias in (("privados", resultados["latenciasPrivados"]),
+                                  ("canal", resultados["latenciasCanal"]),
+                                  ("total", resultados["latenciasPrivados"] + resultados["latenciasCanal"])):
+            if latencias:
+                print "%-10s %10d %10.2f %10.2f %10.2f %10.2f" % ((nombre, len(latencias)) +
+                    tuple(ircStats.percentile(latencias, p) * 1000 for p in (50, 95, 99, 100)))
+
+"""
+    Tormenta de conexiones. IRCServer.connect registra los nicks de uno en uno;
+    aquí se abren miles de conexiones TCP a la vez (o a un ritmo fijo, en
+    conexiones por segundo) y cada una envía NICK y USER en cuanto conecta. Por
+    cada conexión se mide el tiempo hasta que se establece la conexión TCP y
+    hasta que llega RPL_WELCOME, y se anotan los fallos: conexiones rechazadas o
+    que no llegan a establecerse porque la cola de accept() está llena, cierres
+    antes del registro y conexiones sin respuesta.
+
+    Los connect() no bloquean y se siguen con poll hasta que terminan; después
+    cada socket pasa a ser una ircparser.Connection en un Selector. Un servidor
+    con un hilo por cliente suele dejar de aceptar a partir de cierto número de
+    conexiones, que se muestra junto a las latencias por tramos de conexiones
+"""
+class ConnectionStorm(object):
+
+    # Tiempo máximo que se espera a que todas las conexiones terminen de registrarse
+    TIMEOUT = 60
+    # Número de tramos, en orden de lanzamiento, en los que se divide el informe
+    TRAMOS = 10
+
+    def __init__(self, sDroid, conexiones = 1000, ritmo = 0):
+        self.sd = sDroid
+        self.conexiones = conexiones
+        self.ritmo = ritmo
+
+    """
+        SALIDA: Lista con el resultado de cada conexión en orden de lanzamiento: diccionario
+             con el tiempo hasta la conexión TCP ("conexion") y hasta RPL_WELCOME 
+             ("registro"), en segundos, y la causa del fallo ("fallo") si lo hay
+    """
+    def run(self):
+        ircServer = IRCServer(self.sd)
+        ircServer._raiseFileLimit(self.conexiones + 256)
+        direccion = (self.sd.serverIP, self.sd.serverPort)
+        selector = ircparser.Selector()
+        conectando = select.poll()
+        sockets = {}            # fd -> índice, mientras se conecta
+        conexiones = {}         # ircparser.Connection -> índice, mientras se registra
+        self.resultados = []
+        self.inicios = []
+        self.registradas = 0
+        # Primera conexión fallida y conexiones registradas en ese momento
+        self.primerFallo = None
+
+        if self.ritmo:
+            print colored("Abriendo %d conexiones a %d conexiones/s..." % (self.conexiones, self.ritmo), 'green')
+        else:
+            print colored("Abriendo %d conexiones a la vez..." % self.conexiones, 'green')
+        sys.stdout.flush()
+
+        inicio = ircStats.monotonic()
+        limite = None
+        try:
+            while True:
+                ahora = ircStats.monotonic()
+                # Se lanzan las conexiones que tocan según el ritmo
+                debidas = self.conexiones if not self.ritmo else min(self.conexiones, int((ahora - inicio) * self.ritmo) + 1)
+                while len(self.resultados) < debidas:
+                    i = len(self.resultados)
+                    self.resultados.append({"conexion": None, "registro": None, "fallo": None})
+                    self.inicios.append(ircStats.monotonic())
+                    try:
+                        s = socket.socket()
+                    except socket.error as e:
+                        self._fail(i, errno.errorcode.get(e.errno, str(e.errno)) + " (cliente)")
+                        continue
+                    s.setblocking(0)
+                    codigo = s.connect_ex(direccion)
+                    if codigo not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                        s.close()
+                        self._fail(i, errno.errorcode.get(codigo, str(codigo)))
+                        continue
+                    sockets[s.fileno()] = (s, i)
+                    conectando.register(s.fileno(), select.POLLOUT)
+
+                if len(self.resultados) == self.conexiones:
+                    if not sockets and not conexiones:
+                        break
+                    if limite is None:
+                        limite = ahora + self.TIMEOUT
+                    elif ahora > limite:
+                        break
+
+                # Conexiones TCP que han terminado de establecerse (o han fallado)
+                if sockets:
+                    for fd, evento in conectando.poll(0 if conexiones else 10):
+                        s, i = sockets.pop(fd)
+                        conectando.unregister(fd)
+                        codigo = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                        if codigo:
+                            s.close()
+                            self._fail(i, errno.errorcode.get(codigo, str(codigo)))
+                            continue
+                        self.resultados[i]["conexion"] = ircStats.monotonic() - self.inicios[i]
+                        s.setblocking(1)
+                        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                        conn = ircparser.Connection(s, selector = selector, parser = ircparser.translate_lazy)
+                        conexiones[conn] = i
+                        nick = "t" + ircServer.generateRandomString()
+                        with conn.batch():
+                            conn.nick(nick)
+                            conn.user(nick, "0", "*", "R2D2 tormenta")
+
+                # Respuestas al registro
+                for conn in selector.wait(0.001 if sockets or len(self.resultados) < self.conexiones else 0.1):
+                    llegada = ircStats.monotonic()
+                    i = conexiones.get(conn)
+                    while conn.messages:
+                        message = conn.messages.popleft()
+                        if message.num_command == "PING":
+                            conn.pong(*message.params)
+                        elif i is not None and message.command == "RPL_WELCOME":
+                            self.resultados[i]["registro"] = llegada - self.inicios[i]
+                            self.registradas += 1
+                            del conexiones[conn]
+                            i = None
+                        elif i is not None and message.code is not None and message.code >= 400:
+                            self._fail(i, message.command or message.num_command)
+                            del conexiones[conn]
+                            i = None
+                    if conn.closed:
+                        selector.unregister(conn)
+                        if i is not None:
+                            self._fail(i, "cerrada antes de RPL_WELCOME")
+                            del conexiones[conn]
+        finally:
+            duracion = ircStats.monotonic() - inicio
+            for s, i in sockets.values():
+                self._fail(i, "sin conexión TCP (timeout)")
+                s.close()
+            for i in conexiones.values():
+                self._fail(i, "sin RPL_WELCOME (timeout)")
+            for conn in list(selector.connections.values()):
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+        self.showReport(duracion)
+        return self.resultados
+
+    def _fail(self, i, causa):
+        self.resultados[i]["fallo"] = causa
+        if self.primerFallo is None:
+            self.primerFallo = (i, self.registradas)
+
+    def _row(self, nombre, valores):
+        if not valores:
+            return "%-22s %8d" % (nombre, 0)
+        return "%-22s %8d %10.2f %10.2f %10.2f %10.2f" % ((nombre, len(valores)) +
+            tuple(ircStats.percentile(valores, p) * 1000 for p in (50, 95, 99, 100)))
+
+    def showReport(self, duracion):
+        registradas = [r["registro"] for r in self.resultados if r["registro"] is not None]
+        fallos = {}
+        for r in self.resultados:
+            if r["fallo"] is not None:
+                fallos[r["fallo"]] = fallos.get(r["fallo"], 0) + 1
+
+        print
+        print colored("Resultados de la tormenta de conexiones", 'green')
+        print colored("---------------------------------------", 'green')
+        print "Registradas: %d de %d en %.2f s (%.0f registros/s)" % \
+            (len(registradas), len(self.resultados), duracion, len(registradas) / max(duracion, 1e-6)),
+        print colored("[%d FALLOS]" % (len(self.resultados) - len(registradas)), 'red') if fallos else colored("[OK]", 'green')
+        for causa, n in sorted(fallos.items(), key = lambda f: -f[1]):
+            print colored("  %6d  %s" % (n, causa), 'red')
+        if self.primerFallo is not None:
+            print colored("El servidor dejó de aceptar en la conexión %d, con %d conexiones ya registradas" % \
+                (self.primerFallo[0] + 1, self.primerFallo[1]), 'red')
+
+        print
+        print "%-22s %8s %10s %10s %10s %10s" % ("Latencia", "medidas", "p50 (ms)", "p95 (ms)", "p99 (ms)", "max (ms)")
+        print self._row("conexión TCP", [r["conexion"] for r in self.resultados if r["conexion"] is not None])
+        print self._row("RPL_WELCOME", registradas)
+
+        # Latencia de registro y fallos por tramos, en orden de lanzamiento
+        print
+        print "%-22s %8s %10s %10s %10s %10s %8s" % ("Conexiones", "medidas", "p50 (ms)", "p95 (ms)", "p99 (ms)", "max (ms)", "fallos")
+        tam = max(-(-len(self.resultados) // self.TRAMOS), 1)
+        for desde in range(0, len(self.resultados), tam):
+            tramo = self.resultados[desde:desde + tam]
+            fila = self._row("%d-%d" % (desde + 1, desde + len(tramo)), [r["registro"] for r in tramo if r["registro"] is not None])
+            print "%-75s %8d" % (fila, sum(1 for r in tramo if r["fallo"] is not None))
+
+"""
+    Difusión en un canal. sendMessageToChannel comprueba la entrega en cada
+    receptor; aquí un emisor escribe en un canal con K miembros, con K creciendo
+    en pasos geométricos hasta kMax, y un hilo lector que lee a la vez de todos
+    los miembros anota el instante de cada entrega. Para cada K se muestra la
+    distribución de la latencia de entrega y el tiempo hasta que el mensaje llega
+    al último miembro (la difusión completa), y al final se ajusta cómo crece ese
+    tiempo con K: un bucle de difusión que escala bien es O(n)
+
+    Los miembros se conectan con IRCServer.connectBulk y el emisor es un nick
+    normal del IRCServer. Preparar un canal de K miembros cuesta O(K²) mensajes,
+    porque cada JOIN se reenvía a todos los que ya están dentro
+"""
+class FanOutBenchmark(object):
+
+    def __init__(self, sDroid, kMax = 5000, repeticiones = 5):
+        self.sd = sDroid
+        self.kMax = kMax
+        self.repeticiones = repeticiones
+
+    """
+        SALIDA: Lista de tamaños 1, 3, 10, 32, 100... (multiplicando por raíz de 10)
+             hasta kMax, que siempre se incluye
+    """
+    def sizes(self):
+        tamanos = []
+        i = 0
+        while int(round(10 ** (i / 2.0))) < self.kMax:
+            tamanos.append(int(round(10 ** (i / 2.0))))
+            i += 1
+        return tamanos + [self.kMax]
+
+    """
+        SALIDA: Lista de tuplas (K, latencias de todas las entregas, tiempos de difusión
+             completa de cada mensaje), en segundos
+    """
+    def run(self):
+        ircServer = IRCServer(self.sd)
+        self.emisor = "fan" + ircServer.generateRandomString()[:6]
+        self.canal = "#" + ircServer.generateRandomString()
+        self.selector = ircparser.Selector()
+        self.conexiones = {}
+        resultados = []
+
+        ircServer.connect(self.emisor)
+        ircServer.joinChannel(self.emisor, self.canal[1:])
+        try:
+            for k in self.sizes():
+                print colored("Difusión a %d miembros..." % k, 'green')
+                sys.stdout.flush()
+                self._grow(ircServer, k)
+                latencias, completas = self._measure(ircServer, k)
+                resultados.append((k, latencias, completas))
+        finally:
+            ircServer.closeBulk(self.conexiones)
+            ircServer.tearDown()
+
+        self.showReport(resultados)
+        return resultados
+
+    def _grow(self, ircServer, k):
+        nuevos = ircServer.connectBulk(k - len(self.conexiones), self.selector, timeout = 60 + k // 100)
+        self.conexiones.update(nuevos)
+        ircServer.joinBulk(self.conexiones, dict((nick, [self.canal]) for nick in nuevos), timeout = 60 + k // 10)
+        ircServer.drainBulk(self.selector, 0.2)
+        ircServer.discardAll(self.emisor)
+
+    """
+        ENTRADA: IRCServer, número de miembros que deben recibir cada mensaje
+        SALIDA: Tupla (latencias de todas las entregas, tiempo de difusión completa de
+             cada mensaje)
+        FUNCIÓN: Envía los mensajes de uno en uno mientras un hilo lector anota las 
+             entregas, y espera a que cada mensaje llegue a todos antes de enviar el 
+             siguiente
+    """
+    def _measure(self, ircServer, k):
+        lector = _DeliveryReader(self.selector, k)
+        lector.start()
+        latencias, completas = [], []
+        try:
+            for secuencia in range(self.repeticiones):
+                inicio = ircStats.monotonic()
+                ircServer.send(self.emisor, "PRIVMSG %s :%d difusion" % (self.canal, secuencia), medir = False)
+                llegadas = lector.wait(secuencia, 30 + k // 100)
+                assert len(llegadas) == k, "El mensaje %d sólo ha llegado a %d de los %d miembros del canal" % \
+                    (secuencia, len(llegadas), k)
+                latencias.extend(llegada - inicio for llegada in llegadas)
+                completas.append(max(llegadas) - inicio)
+        finally:
+            lector.stop()
+        return latencias, completas
+
+    def showReport(self, resultados):
+        print
+        print colored("Difusión en un canal", 'green')
+        print colored("--------------------", 'green')
+        print "%8s %10s %10s %10s %10s %10s %14s" % ("K", "entregas", "p50 (ms)", "p95 (ms)", "p99 (ms)", "max (ms)", "completa (ms)")
+        for k, latencias, completas in resultados:
+            print "%8d %10d %10.2f %10.2f %10.2f %10.2f %14.2f" % ((k, len(latencias)) +
+                tuple(ircStats.percentile(latencias, p) * 1000 for p in (50, 95, 99, 100)) +
+                (ircStats.median(completas) * 1000,))
+
+        if len(resultados) >= 3:
+            tamanos = [k for k, latencias, completas in resultados]
+            medianas = [ircStats.median(completas) for k, latencias, completas in resultados]
+            ajuste = ircStats.fitComplexity(tamanos, medianas)
+            print
+            print "Crecimiento de la difusión completa: %s (exponente %.2f)" % \
+                (ircStats.COMPLEJIDADES[ajuste], ircStats.loglogSlope(tamanos, medianas)),
+            print colored("[SUPERLINEAL]", 'red') if ajuste > 1 else colored("[OK]", 'green')
+
+"""
+    Hilo que lee de todas las conexiones de un Selector y anota el instante de
+    llegada de cada mensaje de la difusión, identificado por el número con el
+    que empieza su texto
+"""
+class _DeliveryReader(object):
+
+    def __init__(self, selector, esperadas):
+        self.selector = selector
+        self.esperadas = esperadas
+        self.llegadas = {}
+        self.cond = threading.Condition()
+        self.parar = False
+        self.hilo = threading.Thread(target = self._run, name = "Difusion")
+        self.hilo.daemon = True
+
+    def start(self):
+        self.hilo.start()
+
+    def stop(self):
+        self.parar = True
+        self.hilo.join()
+
+    def _run(self):
+        while not self.parar:
+            for conn in self.selector.wait(0.05):
+                llegada = ircStats.monotonic()
+                while conn.messages:
+                    message = conn.messages.popleft()
+                    if message.num_command == "PRIVMSG":
+                        numero = message.params[-1].split(" ", 1)[0]
+                        if numero.isdigit():
+                            with self.cond:
+                                self.llegadas.setdefault(int(numero), []).append(llegada)
+                                self.cond.notify_all()
+                    elif message.num_command == "PING":
+                        conn.pong(*message.params)
+
+    """
+        ENTRADA: Número del mensaje, timeout
+        SALIDA: Instantes de llegada del mensaje, cuando ha llegado a todos o al saltar el timeout
+    """
+    def wait(self, secuencia, timeout):
+        limite = ircStats.monotonic() + timeout
+        with self.cond:
+            while len(self.llegadas.get(secuencia, ())) < self.esperadas:
+                restante = limite - ircStats.monotonic()
+                if restante <= 0:
+                    break
+                self.cond.wait(restante)
+            return list(self.llegadas.get(secuencia, ()))
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+import sys, math, logging
+from termcolor import colored
+import ircparser, ircStats
+from ircServer import IRCServer, Expectation
+
+"""
+    Perfil de complejidad de los comandos del servidor. Para cada comando se hace
+    crecer el estado del servidor (N canales, usuarios o miembros de un canal) en
+    pasos geométricos, de nMin a nMax, y en cada paso se mide la latencia del
+    comando varias veces. Con las medianas se ajusta la curva de crecimiento
+    (O(1), O(n) u O(n²)) y se marcan como superlineales los comandos que crecen
+    más de lo que deberían: un JOIN O(n), como el de un servidor que guarda los
+    canales en una lista enlazada, hace que crear n canales cueste O(n²).
+
+    Los usuarios de relleno se conectan con IRCServer.connectBulk. Los escenarios
+    con miembros de un canal se limitan a maxMiembros, porque cada JOIN se reenvía
+    a todos los miembros y preparar un canal de N miembros cuesta O(N²) mensajes
+"""
+class ComplexityProfiler(object):
+
+    COMANDOS = ["JOIN", "LIST", "NAMES", "WHOIS", "PRIVMSG"]
+
+    # Para cada comando: qué es N y la complejidad esperada (índice en ircStats.COMPLEJIDADES)
+    ESCENARIOS = {"JOIN": ("canales", 0),
+                  "LIST": ("canales", 1),
+                  "NAMES": ("miembros", 1),
+                  "WHOIS": ("usuarios", 0),
+                  "PRIVMSG": ("miembros", 1)}
+
+    CANALES_POR_USUARIO = 100
+
+    def __init__(self, sDroid, nMin = 10, nMax = 10000, maxMiembros = 1000, repeticiones = 5):
+        self.sd = sDroid
+        self.nMin = nMin
+        self.nMax = nMax
+        self.maxMiembros = maxMiembros
+        self.repeticiones = repeticiones
+
+    """
+        ENTRADA: Tamaño máximo
+        SALIDA: Lista de tamaños desde nMin, multiplicando por raíz de 10 (10, 32, 100, 316...)
+    """
+    def sizes(self, nMax):
+        tamanos = []
+        i = 0
+        while True:
+            n = int(round(self.nMin * math.sqrt(10) ** i))
+            if n > nMax:
+                break
+            tamanos.append(n)
+            i += 1
+        return tamanos
+
+    """
+        ENTRADA: Lista de comandos
+        FUNCIÓN: Perfila cada comando y muestra el informe
+    """
+    def run(self, comandos):
+        resultados = []
+        for comando in comandos:
+            assert comando in self.ESCENARIOS, "Comando desconocido: %s (se admiten %s)" % (comando, ", ".join(self.COMANDOS))
+            print colored("Perfilando %s..." % comando, 'green')
+            sys.stdout.flush()
+            resultados.append((comando, self.profile(comando)))
+        self.showReport(resultados)
+        return resultados
+
+    """
+        ENTRADA: Comando
+        SALIDA: Lista de tuplas (N, mediana, percentil 95) con las latencias en segundos
+    """
+    def profile(self, comando):
+        escenario = self.ESCENARIOS[comando][0]
+        nMax = min(self.nMax, self.maxMiembros) if escenario == "miembros" else self.nMax
+
+        ircServer = IRCServer(self.sd)
+        sufijo = ircServer.generateRandomString()[:5]
+        self.nick, self.sonda = "perf" + sufijo, "sond" + sufijo
+        self.canal = ircServer.generateRandomString()
+        self.selector = ircparser.Selector()
+        self.conexiones = {}
+        self.usuarios = []
+        self.numCanales = 0
+
+        ircServer.connect(self.nick)
+        if escenario == "miembros":
+            ircServer.joinChannel(self.nick, self.canal)
+            if comando == "PRIVMSG":
+                ircServer.connect(self.sonda)
+
+        medidas = []
+        try:
+            for n in self.sizes(nMax):
+                getattr(self, "_grow" + escenario.capitalize())(ircServer, n)
+                ircServer.discardAll(self.nick)
+                self.prepare(ircServer, comando)
+
+                latencias = []
+                for i in range(self.repeticiones):
+                    latencias.append(getattr(self, "_measure" + comando)(ircServer))
+                    ircServer.drainBulk(self.selector)
+                medidas.append((n, ircStats.median(latencias), ircStats.percentile(latencias, 95)))
+                logging.info("%s con N=%d: %.2f ms" % (comando, n, medidas[-1][1] * 1000))
+        finally:
+            ircServer.closeBulk(self.conexiones)
+            ircServer.tearDown()
+        return medidas
+
+    def _connect(self, ircServer, numUsuarios):
+        if numUsuarios > 0:
+            nuevos = ircServer.connectBulk(numUsuarios, self.selector, timeout = 60)
+            self.conexiones.update(nuevos)
+            self.usuarios.extend(nuevos)
+
+    def _growCanales(self, ircServer, n):
+        # Los canales se reparten entre usuarios de relleno, CANALES_POR_USUARIO cada uno
+        self._connect(ircServer, -(-n // self.CANALES_POR_USUARIO) - len(self.usuarios))
+        asignacion = {}
+        for i in range(self.numCanales, n):
+            nick = self.usuarios[i // self.CANALES_POR_USUARIO]
+            asignacion.setdefault(nick, []).append("#" + ircServer.generateRandomString())
+        ircServer.joinBulk(self.conexiones, asignacion, timeout = 300)
+        self.numCanales = n
+
+    def _growUsuarios(self, ircServer, n):
+        self._connect(ircServer, n - len(self.usuarios))
+
+    def _growMiembros(self, ircServer, n):
+        anteriores = len(self.usuarios)
+        self._connect(ircServer, n - anteriores)
+        ircServer.joinBulk(self.conexiones, dict((nick, ["#" + self.canal]) for nick in self.usuarios[anteriores:]), timeout = 300)
+
+    """
+        FUNCIÓN: Prepara la medida de un comando tras hacer crecer el servidor
+    """
+    def prepare(self, ircServer, comando):
+        if comando == "PRIVMSG":
+            # La sonda vuelve a entrar en el canal, para ser el último de sus miembros
+            if ircServer.sd.connections[self.sonda].channels:
+                ircServer.send(self.sonda, "PART #%s" % self.canal)
+                ircServer.discardTill(self.sonda, r":\S+ PART #%s" % self.canal)
+            ircServer.joinChannel(self.sonda, self.canal)
+            ircServer.discardAll(self.nick)
+        ircServer.drainBulk(self.selector)
+
+    def _measureJOIN(self, ircServer):
+        canal = ircServer.generateRandomString()
+        inicio = ircStats.monotonic()
+        ircServer.send(self.nick, "JOIN #%s" % canal)
+        llegada = Expectation([(self.nick, r":\S+ JOIN :?#%s" % canal)]).wait(ircServer).timestamp
+        # Sale del canal, que desaparece, para que N no cambie
+        ircServer.send(self.nick, "PART #%s" % canal)
+        ircServer.discardAll(self.nick)
+        return llegada - inicio
+
+    def _measureLIST(self, ircServer):
+        inicio = ircStats.monotonic()
+        for canal in ircServer.iterChannelList(self.nick, timeout = 120):
+            pass
+        return ircStats.monotonic() - inicio
+
+    def _measureNAMES(self, ircServer):
+        inicio = ircStats.monotonic()
+        for usuario in ircServer.iterChannelUsers(self.nick, self.canal, timeout = 120):
+            pass
+        return ircStats.monotonic() - inicio
+
+    def _measureWHOIS(self, ircServer):
+        inicio = ircStats.monotonic()
+        ircServer.send(self.nick, "WHOIS %s" % self.usuarios[-1])
+        recibidas = ircServer.readAllLinesTill(self.nick, "RPL_ENDOFWHOIS", timeout = 30)
+        assert recibidas.has_key("RPL_ENDOFWHOIS"), "No se ha recibido el final de la respuesta a WHOIS"
+        return recibidas.getAll("RPL_ENDOFWHOIS")[-1].timestamp - inicio
+
+    def _measurePRIVMSG(self, ircServer):
+        mensaje = ircServer.generateRandomString()
+        inicio = ircStats.monotonic()
+        ircServer.send(self.nick, "PRIVMSG #%s :%s" % (self.canal, mensaje))
+        llegada = Expectation([(self.sonda, r":\S+ PRIVMSG #%s :%s" % (self.canal, mensaje))]).wait(ircServer).timestamp
+        return llegada - inicio
+
+    def showReport(self, resultados):
+        print
+        print colored("Perfil de complejidad", 'green')
+        print colored("---------------------", 'green')
+        for comando, medidas in resultados:
+            print
+            print "%s (N = %s)" % (comando, self.ESCENARIOS[comando][0])
+            print "%10s %14s %14s" % ("N", "mediana (ms)", "p95 (ms)")
+            for n, mediana, p95 in medidas:
+                print "%10d %14.2f %14.2f" % (n, mediana * 1000, p95 * 1000)
+
+        print
+        print "%-10s %-10s %-10s %-10s %s" % ("Comando", "Esperada", "Ajuste", "Exponente", "")
+        for comando, medidas in resultados:
+            esperada = self.ESCENARIOS[comando][1]
+            if len(medidas) < 3:
+                print "%-10s %-10s %s" % (comando, ircStats.COMPLEJIDADES[esperada], "(faltan medidas para ajustar)")
+                continue
+            tamanos = [n for n, mediana, p95 in medidas]
+            medianas = [mediana for n, mediana, p95 in medidas]
+            ajuste = ircStats.fitComplexity(tamanos, medianas)
+            linea = "%-10s %-10s %-10s %-10.2f" % (comando, ircStats.COMPLEJIDADES[esperada], ircStats.COMPLEJIDADES[ajuste],
+                                                  ircStats.loglogSlope(tamanos, medianas))
+            if ajuste > esperada:
+                print linea, colored("[SUPERLINEAL]", 'red')
+            else:
+                print linea, colored("[OK]", 'green')
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+import os, socket, select, errno, logging, threading, time, collections, functools
+import ircparser, ircStats
+
+"""
+    Entrada de la cola de recepción de un nick: instante de llegada (según
+    ircStats.monotonic), línea
+    recibida (sin fin de línea) y mensaje, que se parsea al consultarlo (ircparser.LazyMessage)
+"""
+Received = collections.namedtuple("Received", ["timestamp", "line", "message"])
+
+"""
+    Flujo de recepción asociado a la conexión de un nick. El hilo de recepción
+    deposita en su cola las líneas que llegan por el socket, y los tests las
+    consumen a través de Receiver.get()
+"""
+class Stream(object):
+
+    def __init__(self, nick, sock):
+        self.nick = nick
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.buffer = ircparser.LineBuffer(Receiver.TAM_LECTURA)
+        self.queue = collections.deque()
+        self.closed = False
+        # Estado de la sesión según lo confirma el servidor: canales en los
+        # que está el nick y si está marcado como AWAY
+        self.channels = set()
+        self.away = False
+        # Las escrituras se hacen desde el hilo del test y desde el de
+        # recepción (respuestas a PING), así que deben ir protegidas
+        self.writeLock = threading.Lock()
+
+    def fileno(self):
+        return self.fd
+
+    def write(self, data):
+        with self.writeLock:
+            self.sock.sendall(data)
+
+    def close(self):
+        self.closed = True
+
+"""
+    Envoltorio sobre epoll (o poll si no está disponible) con timeouts en segundos
+"""
+class Poller(object):
+
+    EVENTOS = select.POLLIN | select.POLLPRI
+
+    def __init__(self):
+        if hasattr(select, "epoll"):
+            self.poller = select.epoll()
+            self.ms = False
+        else:
+            self.poller = select.poll()
+            self.ms = True
+
+    def register(self, fd):
+        try:
+            self.poller.register(fd, self.EVENTOS)
+        except (IOError, OSError) as e:
+            # El descriptor pertenecía a un socket ya cerrado y se ha reutilizado
+            if e.args[0] != errno.EEXIST:
+                raise
+            self.poller.modify(fd, self.EVENTOS)
+
+    def unregister(self, fd):
+        try:
+            self.poller.unregister(fd)
+        except (KeyError, ValueError, IOError, OSError):
+            pass
+
+    def poll(self, timeout = None):
+        if timeout is None:
+            timeout = -1
+        elif self.ms:
+            timeout = int(timeout * 1000) + 1
+        try:
+            return self.poller.poll(timeout)
+        except (select.error, IOError) as e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+
+"""
+    Bucle de recepción único para todas las conexiones. Un hilo en segundo plano
+    espera sobre todos los sockets a la vez, trocea la entrada en líneas, las
+    parsea una sola vez, responde a los PING del servidor y deposita el resultado
+    en la cola de cada nick, con la marca de tiempo de su llegada.
+"""
+class Receiver(object):
+
+    # Tamaño inicial del buffer de cada conexión (crece si llega una línea mayor)
+    TAM_LECTURA = 16384
+
+    def __init__(self):
+        self.streams = {}
+        self.cond = threading.Condition()
+        self.poller = Poller()
+        self.thread = None
+
+        # Tubería para despertar al hilo de recepción cuando cambian los sockets
+        self.wakeR, self.wakeW = os.pipe()
+        self.poller.register(self.wakeR)
+
+    def _wakeUp(self):
+        try:
+            os.write(self.wakeW, "x")
+        except OSError:
+            pass
+
+    """
+        ENTRADA: Nick, socket ya conectado
+        SALIDA: El Stream del nick
+        FUNCIÓN: Añade una conexión al bucle de recepción, arrancándolo si es necesario
+    """
+    def register(self, nick, sock):
+        stream = Stream(nick, sock)
+        with self.cond:
+            self.streams[sock.fileno()] = stream
+            if self.thread is None:
+                self.thread = threading.Thread(target = self._run, name = "Receiver")
+                self.thread.daemon = True
+                self.thread.start()
+        self.poller.register(sock.fileno())
+        self._wakeUp()
+        return stream
+
+    def unregister(self, stream):
+        with self.cond:
+            fd = stream.fileno()
+            if self.streams.get(fd) is stream:
+                del self.streams[fd]
+                self.poller.unregister(fd)
+            stream.close()
+            self.cond.notify_all()
+        self._wakeUp()
+
+    def _run(self):
+        while True:
+            for fd, _ in self.poller.poll():
+                if fd == self.wakeR:
+                    os.read(self.wakeR, 4096)
+                    continue
+
+                with self.cond:
+                    stream = self.streams.get(fd)
+                if stream is not None:
+                    self._readStream(stream)
+
+    """
+        FUNCIÓN: Lee los datos disponibles en el socket de un nick y los deposita,
+        ya troceados y parseados, en su cola
+    """
+    def _readStream(self, stream):
+        try:
+            leidos = stream.buffer.recv_into(stream.sock)
+        except socket.error as e:
+            if e.args[0] in (errno.EINTR, errno.EAGAIN):
+                return
+            leidos = 0
+
+        if not leidos:
+            # Cierre del socket por parte del servidor
+            with self.cond:
+                self.poller.unregister(stream.fileno())
+                stream.closed = True
+                self.cond.notify_all()
+            return
+
+        ahora = ircStats.monotonic()
+        recibidos = []
+        # Todas las líneas completas del buffer se trocean y parsean de una vez con
+        # translate_many, que convierte cada una en su entrada de la cola
+        entradas, _ = ircparser.translate_many(stream.buffer.take(),
+                                               functools.partial(self._parseLine, stream, ahora))
+        for entrada in entradas:
+            message = entrada.message
+
+            # Si se trata de un PING enviado por el servidor, respondemos aquí
+            # PING 1079550066
+            # Reply: PONG 1079550066
+            if message is not None and message['num_command'] == "PING":
+                logging.debug("<< SERVER: %s" % entrada.line)
+                try:
+                    stream.write("PONG :%s\r\n" % (message['params'][0] if message['params'] else ""))
+                except socket.error:
+                    pass
+                continue
+
+            if message is not None:
+                self._trackState(stream, message)
+            recibidos.append(entrada)
+
+        if recibidos:
+            with self.cond:
+                stream.queue.extend(recibidos)
+                self.cond.notify_all()
+
+    """
+        ENTRADA: Flujo, instante de llegada, línea recibida
+        SALIDA: Received con la línea y su mensaje, o None si la línea está en blanco
+        FUNCIÓN: Parser de cada línea para ircparser.translate_many. Sólo se extrae el
+        comando; el resto se parsea si alguien lo consulta (ircparser.LazyMessage)
+    """
+    def _parseLine(self, stream, ahora, line):
+        line = line.rstrip()
+
+        if b'\x00' in line:
+            logging.debug("AVISO: Se ha detectado un carácter NULL dentro de la cadena enviada por el servidor.")
+            line = line.replace('\x00', '') # CGS: El curso que viene, esto dará un error
+
+        if len(line) == 0:
+            logging.debug("AVISO: Recibida línea en blanco no esperada por el socket de %s. Puede ser debido a excesivas llamadas a send(), o que el mensaje anterior tiene caracteres de fin de cadena mal formados" % stream.nick)
+            return None
+
+        return Received(ahora, line, ircparser.translate_lazy(line))
+
+    """
+        FUNCIÓN: Actualiza el estado de la sesión de un nick (nick actual, canales, AWAY)
+        a partir de las confirmaciones que envía el servidor
+    """
+    def _trackState(self, stream, message):
+        command = message['num_command']
+
+        # Se comprueba primero el comando, para no parsear el resto del mensaje
+        # salvo en los que cambian el estado
+        if command in ("JOIN", "PART", "NICK"):
+            params = message['params']
+            if message['nick'] == stream.nick and params:
+                if command == "JOIN":
+                    stream.channels.add(params[0])
+                elif command == "PART":
+                    stream.channels.discard(params[0])
+                else:
+                    stream.nick = params[0]
+        elif command == "KICK":
+            params = message['params']
+            if len(params) > 1 and params[1] == stream.nick:
+                stream.channels.discard(params[0])
+        elif message['command'] == "RPL_NOWAWAY":
+            stream.away = True
+        elif message['command'] == "RPL_UNAWAY":
+            stream.away = False
+
+    """
+        ENTRADA: Lista de Stream, timeout en segundos (admite decimales)
+        SALIDA: Tupla (stream, Received) con la primera entrada disponible en
+        cualquiera de los flujos, o None si salta el timeout
+        FUNCIÓN: Consume la siguiente línea recibida por alguno de los flujos. Lanza
+        EOFError, con el flujo como argumento, si alguno se ha cerrado y su cola está vacía
+    """
+    def get(self, streams, timeout = None):
+        limite = None if timeout is None else time.time() + timeout
+
+        with self.cond:
+            while True:
+                for stream in streams:
+                    if stream.queue:
+                        return stream, stream.queue.popleft()
+                    if stream.closed:
+                        raise EOFError(stream)
+
+                if limite is None:
+                    self.cond.wait()
+                else:
+                    restante = limite - time.time()
+                    if restante <= 0:
+                        return None
+                    self.cond.wait(restante)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import sys, heapq, threading
+
+"""
+    Planificador de pruebas según sus dependencias. Con el atributo dependencias
+    de cada test (nombres de clase de otros tests) construye un grafo dirigido
+    acíclico sobre la lista de tests a ejecutar, y lanza en cada momento los tests
+    cuyas dependencias ya han pasado, con tantos hilos como se indique. Entre los
+    tests listos se elige siempre el primero de la lista, así que con un solo hilo
+    se respeta el orden original.
+
+    Si un test falla, los que dependen de él (directa o indirectamente) no se
+    ejecutan y se dan por fallidos. Las dependencias de tests que no están en la
+    lista se ignoran.
+"""
+class TestScheduler(object):
+
+    """
+        ENTRADA: Lista de tests, función que ejecuta un test y devuelve una tupla
+        (puntuación, AssertionError o None), número de hilos
+    """
+    def __init__(self, listaTests, ejecutar, numHilos = 1):
+        self.tests = listaTests
+        self.ejecutar = ejecutar
+        self.numHilos = max(numHilos, 1)
+
+        indices = dict((type(test).__name__, i) for i, test in enumerate(listaTests))
+        self.dependientes = [[] for test in listaTests]
+        self.numDependencias = [0] * len(listaTests)
+        for i, test in enumerate(listaTests):
+            for nombre in set(test.dependencias):
+                if nombre in indices:
+                    self.dependientes[indices[nombre]].append(i)
+                    self.numDependencias[i] += 1
+
+        self._checkCycles()
+
+        # Resultado de cada test: (resultado de ejecutar, sys.exc_info() o None)
+        self.resultados = [None] * len(listaTests)
+        self.listos = [i for i, n in enumerate(self.numDependencias) if n == 0]
+        heapq.heapify(self.listos)
+        self.pendientes = len(listaTests)
+        self.abortado = False
+        self.error = None
+        self.cond = threading.Condition()
+
+    """
+        FUNCIÓN: Comprueba que las dependencias no forman ciclos (algoritmo de Kahn).
+        Lanza ValueError con los tests implicados si los hay
+    """
+    def _checkCycles(self):
+        restantes = list(self.numDependencias)
+        cola = [i for i, n in enumerate(restantes) if n == 0]
+        visitados = 0
+        while cola:
+            i = cola.pop()
+            visitados += 1
+            for j in self.dependientes[i]:
+                restantes[j] -= 1
+                if restantes[j] == 0:
+                    cola.append(j)
+
+        if visitados < len(self.tests):
+            ciclo = [type(test).__name__ for i, test in enumerate(self.tests) if restantes[i] > 0]
+            raise ValueError("Hay dependencias cíclicas entre las pruebas: %s" % ", ".join(ciclo))
+
+    """
+        FUNCIÓN: Marca como fallidos, sin ejecutarlos, todos los tests que dependen
+        del indicado. Se llama con el cerrojo tomado
+    """
+    def _skipDependents(self, i, causa):
+        for j in self.dependientes[i]:
+            if self.resultados[j] is not None:
+                continue
+            error = AssertionError("No se ha ejecutado porque depende de %s, que ha fallado" % causa)
+            self.resultados[j] = ((0, error), None)
+            self.pendientes -= 1
+            self._skipDependents(j, causa)
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while not self.listos and self.pendientes > 0 and not self.abortado:
+                    self.cond.wait()
+                if self.abortado or not self.listos:
+                    return
+                i = heapq.heappop(self.listos)
+
+            try:
+                resultado = (self.ejecutar(self.tests[i]), None)
+            except Exception:
+                resultado = (None, sys.exc_info())
+
+            with self.cond:
+                self.resultados[i] = resultado
+                self.pendientes -= 1
+                if resultado[1] is not None:
+                    # Error crítico: no se lanzan más tests
+                    self.abortado = True
+                    self.error = resultado[1]
+                elif resultado[0][1] is not None:
+                    self._skipDependents(i, type(self.tests[i]).__name__)
+                else:
+                    for j in self.dependientes[i]:
+                        self.numDependencias[j] -= 1
+                        if self.numDependencias[j] == 0 and self.resultados[j] is None:
+                            heapq.heappush(self.listos, j)
+                self.cond.notify_all()
+
+    """
+        SALIDA: Generador con el resultado de cada test en el orden de la lista, según
+        van estando disponibles. Si un test lanza una excepción distinta de
+        AssertionError, se relanza al llegar a él
+    """
+    def run(self):
+        for n in range(min(self.numHilos, len(self.tests))):
+            hilo = threading.Thread(target = self._worker, name = "Test-%d" % n)
+            hilo.daemon = True
+            hilo.start()
+
+        for i in range(len(self.tests)):
+            with self.cond:
+                while self.resultados[i] is None and not self.abortado:
+                    self.cond.wait(0.5)
+                resultado, error = self.resultados[i] or (None, self.error)
+
+            if error is not None:
+                raise error[0], error[1], error[2]
+            yield resultado
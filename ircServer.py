@@ -1,50 +1,418 @@
 # -*- coding: utf-8 -*-
 import os, re, shutil, signal, socket, logging, time
-import random, string
-import ircparser
+import random, string, itertools, collections, contextlib
+import ircparser, ircStats
+
+"""
+    Resultado de una expectativa cumplida: posición del patrón en la expectativa,
+    nick por el que se ha recibido la línea, objeto match e instante de llegada
+"""
+ExpectationMatch = collections.namedtuple("ExpectationMatch", ["index", "nick", "match", "timestamp"])
+
+"""
+    Expectativa sobre la salida del servidor formada por uno o varios patrones,
+    que se compilan una única vez al crearla. Cada patrón puede ser una expresión
+    regular, que se comprueba contra las líneas de cualquiera de los nicks, o una 
+    tupla (nick, expresión), que sólo se comprueba contra las de ese nick. 
+    
+    En lugar de una expresión también se puede dar un código numérico entero (por
+    ejemplo codes.number("ERR_BADCHANNELKEY")) o un conjunto de ellos (como 
+    xrange(400, 500) para cualquier error), que se compara con el código ya 
+    parseado de cada línea sin pasar por expresiones regulares. En ese caso, el 
+    match del ExpectationMatch es el mensaje parseado.
+    
+    Se puede esperar a que se cumpla cualquiera de los patrones (ANY) o todos 
+    ellos (ALL), y opcionalmente exigir que se cumplan en el orden dado.
+"""
+class Expectation(object):
+    
+    ANY = "any"
+    ALL = "all"
+    
+    def __init__(self, patrones, modo = ANY, ordenado = False, descartar = True):
+        self.nicks = []
+        self.regexps = []
+        self.patrones = []
+        # Códigos numéricos de los patrones que no son expresiones regulares
+        self.codigos = []
+        for patron in patrones:
+            nick, regexp = patron if isinstance(patron, tuple) else (None, patron)
+            if isinstance(regexp, basestring):
+                self.regexps.append(regexp)
+                self.patrones.append(re.compile(regexp))
+                self.codigos.append(None)
+            elif isinstance(regexp, (int, xrange, set, frozenset)):
+                codigos = frozenset([regexp] if isinstance(regexp, int) else regexp)
+                orden = sorted(codigos)
+                if len(orden) > 2 and orden[-1] - orden[0] == len(orden) - 1:
+                    self.regexps.append("código %03d-%03d" % (orden[0], orden[-1]))
+                else:
+                    self.regexps.append("código %s" % "/".join("%03d" % c for c in orden))
+                self.patrones.append(None)
+                self.codigos.append(codigos)
+            else:
+                self.regexps.append(regexp.pattern)
+                self.patrones.append(regexp)
+                self.codigos.append(None)
+            self.nicks.append(nick)
+            
+        self.modo = modo
+        self.ordenado = ordenado
+        # Si es False, cualquier línea que no encaje con un patrón pendiente es un error
+        self.descartar = descartar
+        
+    def _describe(self, indices):
+        return " / ".join(("%r" if self.codigos[i] is None else "%s") % self.regexps[i] for i in indices)
+    
+    """
+        ENTRADA: Objeto IRCServer, nicks de los que leer (por defecto, los de los patrones), timeout
+        total, si se mide la latencia de los comandos a los que responde
+        SALIDA: En modo ANY, el ExpectationMatch del primer patrón que se cumple. En 
+        modo ALL, la lista de ExpectationMatch en el orden en que se han cumplido
+        FUNCIÓN: Consume la salida de los nicks hasta que se cumple la expectativa. Las
+        líneas que no encajan con ningún patrón pendiente se descartan, o provocan un
+        error si descartar es False. Lanza AssertionError si salta el timeout. Al 
+        cumplirse, se anota en ircServer la latencia de los comandos a los que responde
+    """
+    def wait(self, ircServer, nicks = None, timeout = 5, medir = True):
+        if nicks is None:
+            nicks = set(nick for nick in self.nicks if nick is not None)
+        leyendo = set(nicks)
+        pendientes = range(len(self.patrones))
+        cumplidos = []
+        llegadas = []
+        if not pendientes:
+            return cumplidos
+        
+        for nick, entrada in ircServer._readMessagesFrom(leyendo, timeout):
+            # En orden, sólo puede cumplirse el primero de los patrones pendientes
+            candidatos = pendientes[:1] if self.ordenado else pendientes
+            candidatos = [i for i in candidatos if self.nicks[i] in (None, nick)]
+                
+            m = None
+            for i in candidatos:
+                if self.codigos[i] is None:
+                    m = self.patrones[i].match(entrada.line)
+                elif entrada.message is not None and entrada.message.code in self.codigos[i]:
+                    m = entrada.message
+                if m is not None:
+                    break
+                
+            if m is None:
+                assert self.descartar, "Los datos recibidos %r por el socket de %s no encajan con la expresión requerida %s" % \
+                    (entrada.line, nick, self._describe(candidatos))
+                continue
+            
+            cumplido = ExpectationMatch(i, nick, m, entrada.timestamp)
+            if self.modo == self.ANY:
+                if medir:
+                    ircServer._recordLatency([(nick, entrada)])
+                return cumplido
+            
+            cumplidos.append(cumplido)
+            llegadas.append((nick, entrada))
+            pendientes.remove(i)
+            if not pendientes:
+                if medir:
+                    ircServer._recordLatency(llegadas)
+                return cumplidos
+            
+            # Dejamos de leer de los nicks que ya no tienen ningún patrón pendiente
+            for n in list(leyendo):
+                if not any(self.nicks[j] in (None, n) for j in pendientes):
+                    leyendo.discard(n)
+                
+        raise AssertionError("Se esperaba recibir la expresión %s desde el socket de %s, pero ha saltado el timeout" % \
+                             (self._describe(pendientes), ", ".join(nicks)))
+
+"""
+    Líneas recibidas por un nick, en orden de llegada y con su instante de
+    recepción (ircReceiver.Received). Además de recorrerse como una lista, se
+    pueden consultar por comando como un diccionario: lineas["RPL_AWAY"] es la
+    última línea con ese comando y getAll("RPL_AWAY") todas ellas. El comando
+    puede darse por su nombre en codes ("RPL_MOTD"), tal y como se recibe
+    ("372", "PRIVMSG") o por su código entero (372)
+"""
+class ReceivedLines(object):
+    
+    def __init__(self, entradas = ()):
+        self.entradas = []
+        # Comando -> posiciones de sus líneas en entradas
+        self.indice = {}
+        for entrada in entradas:
+            self.append(entrada)
+    
+    def append(self, entrada):
+        message = entrada.message
+        if message is not None:
+            claves = set([message['command'] or message['num_command'], message['num_command'], message.code])
+            claves.discard(None)
+            for clave in claves:
+                self.indice.setdefault(clave, []).append(len(self.entradas))
+        self.entradas.append(entrada)
+    
+    def __len__(self):
+        return len(self.entradas)
+    
+    def __iter__(self):
+        return iter(self.entradas)
+    
+    def has_key(self, comando):
+        return comando in self.indice
+    
+    __contains__ = has_key
+    
+    def __getitem__(self, comando):
+        return self.entradas[self.indice[comando][-1]].line
+    
+    def get(self, comando, default = None):
+        return self[comando] if comando in self.indice else default
+    
+    """
+        SALIDA: Lista con todas las entradas (instante, línea y mensaje) de ese comando
+    """
+    def getAll(self, comando):
+        return [self.entradas[i] for i in self.indice.get(comando, [])]
+    
+    """
+        SALIDA: Comandos recibidos, por su nombre o como se recibieron, en orden de llegada
+    """
+    def keys(self):
+        vistos = []
+        for entrada in self.entradas:
+            if entrada.message is not None:
+                clave = entrada.message['command'] or entrada.message['num_command']
+                if clave not in vistos:
+                    vistos.append(clave)
+        return vistos
+    
+    def lines(self):
+        return [entrada.line for entrada in self.entradas]
 
 """
     Clase abstracta que define un test genérico
 """
 class IRCServer(object):
     
-    REGEXP_PING = r'PING (\S+)'
+    REGEXP_PONG = r'(:\S+ )?PONG .*%s'
+    
+    # Comandos cuya respuesta es su entrega, con el mismo comando, a otros nicks
+    COMANDOS_ENTREGA = frozenset(["PRIVMSG", "NOTICE", "KICK", "INVITE"])
+    
+    # Identificadores únicos para los PING de sincronización
+    syncIds = itertools.count(1)
     
     def __init__(self, sDroid):
         self.sd = sDroid
+        # Comandos pendientes de envío por nick mientras hay un batch() abierto
+        self.pendientes = None
+        # Nicks que ha usado este objeto; tearDown() sólo cierra estos, de modo
+        # que varios tests pueden compartir el servidor en paralelo
+        self.nicks = set()
+        # Si connect() puede entregar sesiones de reserva del pool (ya registradas y
+        # renombradas con NICK) en lugar de registrar el nick con NICK y USER
+        self.sesionesReserva = True
+        # Comandos enviados pendientes de respuesta por nick, en orden de envío:
+        # colas de tuplas (comando, instante)
+        self.enviosPendientes = {}
+        # Histogramas de latencia (ircStats.Histogram) de cada comando, desde
+        # que se envía hasta que llega la respuesta esperada
+        self.latencias = {}
         
     def connect(self, nick):
-        
-        # Si ya está establecida la conexión, nada que hacer
-        if self.sd.connections.has_key(nick):
-            # Limpiamos los posibles mensajes anteriores
-            self.discardAll(nick)            
-            return        
-        
-        s = socket.socket()
-        s.settimeout(5)
-        try:
+        self.connectMany([nick])
+    
+    """
+        ENTRADA: Lista de nicks
+        SALIDA: Ninguna
+        FUNCIÓN: Conecta y registra varios nicks a la vez. Primero abre todas las
+        conexiones y envía los comandos de registro, y luego espera las respuestas 
+        en todos los sockets de forma concurrente
+    """
+    def connectMany(self, nicks):
+        
+        nuevos = []
+        for nick in nicks:
+            self.nicks.add(nick)
+            # Si ya está establecida la conexión, nada que hacer
+            if self.sd.connections.has_key(nick):
+                continue
+            
+            # Si hay una sesión ya registrada de reserva, se reutiliza
+            if self.sesionesReserva and self.sd.sessionPool is not None and \
+               self.sd.sessionPool.acquire(self, nick):
+                continue
+            
+            s = socket.socket()
+            s.settimeout(5)
             # Intento de conexión            
             s.connect((self.sd.serverIP, self.sd.serverPort))
-            # Es necesario volver a establecer el socket como bloqueante
-            # para la llamada a makefile
+            # Las escrituras son bloqueantes; las lecturas las hace el hilo de
+            # recepción sólo cuando hay datos, por lo que nunca se bloquean
             s.settimeout(None)        
+            # Sin el algoritmo de Nagle, para que cada comando salga en cuanto se 
+            # escribe y no retrase las respuestas (ni falsee su latencia)
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         
             # Todo ha ido bien
-            self.sd.connections[nick] = s.makefile(mode="rw")      
+            self.sd.connections[nick] = self.sd.receiver.register(nick, s)      
             self.sd.sockets[nick] = s
             
-            # Se envían los comandos de registro       
-            self.send(nick, "NICK %s" % nick)
-            self.send(nick, "USER %s * * :%s" % (nick, nick))
+            # Se envían los comandos de registro, cuya latencia se mide junta hasta el 001
+            self._awaitReply(nick, "NICK+USER")
+            self.send(nick, "NICK %s" % nick, medir = False)
+            self.send(nick, "USER %s * * :%s" % (nick, nick), medir = False)
+            nuevos.append(nick)
                              
-            # Comenzamos a parsear y comprobar las respuestas. Se descarta toda 
-            # entrada hasta el primer código 001                       
-            self.discardTill(nick, r":\S* 001 %s :.*" % nick)
-            self.discardAll(nick)                 
-        except Exception as e:
-            raise e
+        # Comenzamos a parsear y comprobar las respuestas. Se descarta toda 
+        # entrada hasta el primer código 001                       
+        self.discardTillMany(dict((nick, r":\S* 001 %s :.*" % nick) for nick in nuevos))
+        
+        # Limpiamos los posibles mensajes anteriores o restantes
+        self.discardAllMany(nicks)
         
+    """
+        ENTRADA: Número de conexiones que se van a abrir
+        FUNCIÓN: Sube, si hace falta y el sistema lo permite, el límite de descriptores
+             abiertos del proceso, para las pruebas con miles de conexiones
+    """
+    def _raiseFileLimit(self, necesarios):
+        try:
+            import resource
+        except ImportError:
+            return
+        blando, duro = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if blando != resource.RLIM_INFINITY and blando < necesarios:
+            nuevo = necesarios if duro == resource.RLIM_INFINITY else min(necesarios, duro)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (nuevo, duro))
+    
+    """
+        ENTRADA: Número de usuarios, ircparser.Selector en el que registrarlos (si no se
+             da se crea uno, accesible como conn.selector), timeout total
+        SALIDA: Diccionario nick -> ircparser.Connection con los usuarios ya registrados
+        FUNCIÓN: Conecta y registra a la vez muchos usuarios con nicks aleatorios, para
+             las pruebas de carga. Estas conexiones no pasan por el hilo de recepción
+             ni por tearDown(), así que hay que cerrarlas con closeBulk()
+    """
+    def connectBulk(self, numUsuarios, selector = None, timeout = 30):
+        if selector is None:
+            selector = ircparser.Selector()
+        self._raiseFileLimit(len(selector) + numUsuarios + 256)
+        
+        conexiones = {}
+        try:
+            for i in range(numUsuarios):
+                nick = "c" + self.generateRandomString()
+                conn = ircparser.Connection((self.sd.serverIP, self.sd.serverPort), selector = selector,
+                                            parser = ircparser.translate_lazy)
+                conexiones[nick] = conn
+                with conn.batch():
+                    conn.nick(nick)
+                    conn.user(nick, "0", "*", "R2D2 carga")
+            
+            self.waitBulk(dict((conn, 1) for conn in conexiones.values()), "RPL_WELCOME", timeout)
+        except:
+            self.closeBulk(conexiones)
+            raise
+        return conexiones
+    
+    """
+        ENTRADA: Diccionario nick -> ircparser.Connection, diccionario nick -> lista de
+             canales (con #), timeout total
+        FUNCIÓN: Cada usuario se une a sus canales, enviando todos los JOIN de una vez,
+             y se espera la confirmación de todos ellos
+    """
+    def joinBulk(self, conexiones, canales, timeout = 120):
+        nicks = dict((conn, nick) for nick, conn in conexiones.items())
+        for nick, lista in canales.items():
+            conexiones[nick].send_many({"command": "JOIN", "params": [canal]} for canal in lista)
+        
+        # Sólo cuentan las confirmaciones de los JOIN propios, no las de los demás
+        self.waitBulk(dict((conexiones[nick], len(lista)) for nick, lista in canales.items()), "JOIN", timeout,
+                      cuenta = lambda conn, message: message.nick == nicks[conn])
+    
+    """
+        ENTRADA: Diccionario ircparser.Connection -> número de mensajes esperados, comando,
+             timeout total, función que decide si un mensaje del comando cuenta
+        FUNCIÓN: Lee de todas las conexiones de su selector hasta que cada una ha 
+             recibido sus mensajes de ese comando, respondiendo a los PING del servidor
+             y descartando el resto. Lanza AssertionError si se recibe un error 
+             (4xx/5xx), se cierra una conexión o salta el timeout
+    """
+    def waitBulk(self, pendientes, comando, timeout = 30, cuenta = None):
+        pendientes = dict((conn, n) for conn, n in pendientes.items() if n > 0)
+        if not pendientes:
+            return
+        selector = next(iter(pendientes)).selector
+        limite = time.time() + timeout
+        
+        while pendientes:
+            restante = limite - time.time()
+            assert restante > 0, "Se esperaban %d mensajes %s más en %d conexiones, pero ha saltado el timeout" % \
+                (sum(pendientes.values()), comando, len(pendientes))
+            
+            for conn in selector.wait(restante):
+                while conn.messages:
+                    message = conn.messages.popleft()
+                    if message.num_command == "PING":
+                        conn.pong(*message.params)
+                        continue
+                    code = message.code
+                    assert code is None or code < 400, "El servidor ha respondido con un error: %s %s" % \
+                        (message.num_command, " ".join(message.params))
+                    if conn in pendientes and comando in (message.command, message.num_command) and \
+                       (cuenta is None or cuenta(conn, message)):
+                        pendientes[conn] -= 1
+                        if not pendientes[conn]:
+                            del pendientes[conn]
+                assert not conn.closed, "El servidor ha cerrado una de las conexiones de la prueba"
+    
+    """
+        ENTRADA: ircparser.Selector, tiempo que se espera a que llegue algo
+        FUNCIÓN: Lee y descarta todo lo que han recibido las conexiones del selector, 
+             respondiendo a los PING, para que los mensajes que no interesan no llenen
+             los buffers y el servidor no tenga que retenerlos
+    """
+    def drainBulk(self, selector, timeout = 0):
+        listas = selector.wait(timeout)
+        while listas:
+            for conn in listas:
+                while conn.messages:
+                    message = conn.messages.popleft()
+                    if message.num_command == "PING":
+                        conn.pong(*message.params)
+            listas = [conn for conn in selector.wait(0) if not conn.closed]
+    
+    def closeBulk(self, conexiones):
+        for conn in conexiones.values():
+            try:
+                conn.close()
+            except Exception:
+                pass
+    
+    """
+        SALIDA: psutil.Process del servidor, o None si no se puede saber cuál es o no
+             está instalado psutil
+        FUNCIÓN: Usa el PID indicado (sd.serverPid) o, si el servidor es local, busca
+             el proceso que escucha en su puerto
+    """
+    def serverProcess(self):
+        try:
+            import psutil
+        except ImportError:
+            return None
+        try:
+            if self.sd.serverPid is not None:
+                return psutil.Process(self.sd.serverPid)
+            if self.sd.serverIP not in ("127.0.0.1", "localhost", "::1"):
+                return None
+            for c in psutil.net_connections("tcp"):
+                if c.status == psutil.CONN_LISTEN and c.laddr[1] == self.sd.serverPort and c.pid:
+                    return psutil.Process(c.pid)
+        except (psutil.Error, OSError):
+            pass
+        return None
+    
     def shutDown(self):
         os.kill(self.child_pid, signal.SIGTERM)
         os.waitpid(self.child_pid, 0)
@@ -56,205 +424,391 @@ class IRCServer(object):
 
     def tearDown(self):
         logging.debug("Cerrando todas las conexiones activas...")
-        try:        
-            for x in self.sd.sockets.values():                
-                x.shutdown(socket.SHUT_WR)
-                x.close()            
-        except Exception:
-            pass
-        finally:
-            for x in self.sd.connections.values():
-                x.close()
-            self.sd.connections.clear()
+        cerradas = 0
+        for nick in list(self.nicks):
+            if nick not in self.sd.connections:
+                self.nicks.discard(nick)
+                continue
+            # Las sesiones que siguen vivas se limpian y vuelven al pool
+            if self.sd.sessionPool is not None and self.sd.sessionPool.release(self, nick):
+                self.nicks.discard(nick)
+                continue
+            # Si el servidor la ha cerrado mientras se limpiaba, ya está eliminada
+            if nick in self.sd.connections:
+                self._closeConnection(nick)
+            cerradas += 1
 
         # Damos tiempo a que la otra parte cierre sus conexiones
-        time.sleep(1)
+        if cerradas:
+            time.sleep(1)
         
-    def send(self, nick, message):
-        if nick in self.sd.connections:
-            logging.debug(">> envío a socket de %s: %s" % (nick,message))
-            self.sd.connections[nick].write(message + "\r\n")        
-            self.sd.connections[nick].flush()    
+    """
+        ENTRADA: Nick, comando, si se mide la latencia hasta la respuesta esperada
+        FUNCIÓN: Envía un comando, o lo acumula si hay un batch() abierto. La latencia
+             se anota al cumplirse la expectativa que responde al comando (ver 
+             _recordLatency). Los comandos de un batch() no se miden: su respuesta 
+             incluiría el tiempo de todo el lote
+    """
+    def send(self, nick, message, medir = True):
+        if self.pendientes is not None:
+            self.pendientes.setdefault(nick, []).append(message)
         else:
-            raise AssertionError("El servidor ha cerrado el socket de %s, y no se ha podido mandar el mensaje: %s" % (nick,message))
+            if medir:
+                self._awaitReply(nick, message.split(" ", 1)[0].upper())
+            self.sendMany(nick, [message])
+    
+    def _awaitReply(self, nick, comando):
+        if nick not in self.enviosPendientes:
+            self.enviosPendientes[nick] = collections.deque()
+        self.enviosPendientes[nick].append((comando, ircStats.monotonic()))
             
-    def _readLine(self, nick, regexp = "", timeout = 5):
-        # Sorprendemente, Python 2.x no tiene soporte no bloqueante
-        # para la función readline(), así que hay que utilizar este "truco"
-        def timeout_handler(signum, frame):
+    """
+        ENTRADA: Nick, lista de comandos
+        FUNCIÓN: Envía todos los comandos de un nick en una única escritura, de forma 
+             que el servidor los recibe juntos (normalmente en un mismo segmento TCP)
+    """
+    def sendMany(self, nick, mensajes):
+        if not mensajes:
+            return
+        if nick in self.sd.connections:
+            for message in mensajes:
+                logging.debug(">> envío a socket de %s: %s" % (nick,message))
+            try:
+                self.sd.connections[nick].write("\r\n".join(mensajes) + "\r\n")
+                return
+            except socket.error:
+                # El servidor ha cerrado el socket pero aún no se ha procesado el cierre
+                pass
+        raise AssertionError("El servidor ha cerrado el socket de %s, y no se ha podido mandar el mensaje: %s" % (nick,mensajes[0]))
+    
+    """
+        FUNCIÓN: Gestor de contexto que acumula los comandos enviados con send() y, al
+             salir del bloque, los envía con una única escritura por nick:
+             
+                 with ircServer.batch():
+                     for canal in canales:
+                         ircServer.send(nick, "JOIN #%s" % canal)
+                         
+             Si dentro del bloque se espera alguna respuesta, antes se envía lo acumulado
+    """
+    @contextlib.contextmanager
+    def batch(self):
+        if self.pendientes is not None:
+            # Batch anidado: se envía todo al cerrar el exterior
+            yield
+            return
+        
+        self.pendientes = {}
+        try:
+            yield
+            self.flush()
+        finally:
+            self.pendientes = None
+    
+    """
+        FUNCIÓN: Envía los comandos acumulados en el batch() abierto, si lo hay
+    """
+    def flush(self):
+        if not self.pendientes:
+            return
+        pendientes, self.pendientes = self.pendientes, {}
+        for nick, mensajes in pendientes.items():
+            self.sendMany(nick, mensajes)
+            
+    """
+        ENTRADA: Nick, expresión esperada (sólo para el mensaje de error), timeout en segundos
+        SALIDA: La siguiente entrada de la cola de recepción del nick (ircReceiver.Received),
+        con la línea, el mensaje ya parseado y su instante de llegada
+    """
+    def _readMessage(self, nick, regexp = "", timeout = 5):
+        self.flush()
+        # Las líneas las recibe, parsea y encola el hilo de recepción, que 
+        # también responde a los PING del servidor
+        try:
+            recibido = self.sd.receiver.get([self.sd.connections[nick]], timeout)
+        except EOFError:
+            self._closeConnection(nick)
+            raise AssertionError("El socket de %s ha sido cerrado inesperadamente por parte del servidor" % nick)
+        
+        if recibido is None:
             if len(regexp) > 0:
                 raise AssertionError("Se esperaba recibir la expresión %s desde el socket de %s, pero ha saltado el timeout" % (regexp,nick))
             else:
                 raise AssertionError("Se esperaba recibir datos desde el socket de %s, pero ha saltado el timeout" % nick)
-        signal.signal(signal.SIGALRM, timeout_handler)
-        
-        line = ""
-        emptyCount = 0
-        while True:
-            # Establecemos el timeout y leemos una línea
-            signal.alarm(timeout)  
-            line = self.sd.connections[nick].readline().rstrip()        
-            signal.alarm(0)                
-            
-            if b'\x00' in line:
-                logging.debug("AVISO: Se ha detectado un carácter NULL dentro de la cadena enviada por el servidor.")
-                line = line.replace('\x00', '') # CGS: El curso que viene, esto dará un error
-                #raise AssertionError("Se ha detectado un carácter NULL dentro de la cadena enviada por el servidor.")
-        
-            # Si se trata de un PING enviado por el servidor, respondemos aquí
-            # PING 1079550066
-            # Reply: PONG 1079550066                              
-                
-            m = re.match(self.REGEXP_PING, line)
         
-            if m is not None:
-                # Hemos recibido un PING, respondemos
-                params = m.group(1)                                          
+        logging.debug("<< socket de %s dice: %s" % (nick, recibido[1].line))
+        return recibido[1]
+    
+    def _readLine(self, nick, regexp = "", timeout = 5):
+        return self._readMessage(nick, regexp, timeout).line
+    
+    """
+        ENTRADA: Conjunto de nicks, timeout total en segundos
+        SALIDA: Generador de tuplas (nick, ircReceiver.Received) en el orden en que
+        llegan por cualquiera de los sockets
+        FUNCIÓN: Lee a la vez de los sockets de varios nicks. El llamante puede 
+        eliminar nicks del conjunto mientras itera para dejar de leer de ellos.
+        Termina cuando el conjunto queda vacío o cuando salta el timeout
+    """
+    def _readMessagesFrom(self, nicks, timeout = 5):
+        self.flush()
+        limite = time.time() + timeout
+        
+        while nicks:
+            restante = limite - time.time()
+            if restante <= 0:
+                return
             
-                logging.debug("<< SERVER: %s" % line)            
-                pong_reply = "PONG %s" % params
-                pong_reply.rstrip('\r\n ')
-                self.send(nick, pong_reply)
-            else:
-                if len(line) > 0 and len(line.rstrip('\r\n ')) > 0:
-                    # Si no se trata de un PING, salimos y devolvemos la línea leida
-                    logging.debug("<< socket de %s dice: %s" % (nick, line))
-                    break
-                else: # ignoramos líneas en blanco
-                    if emptyCount > 5: #detectamos cierres del socket
-                        break
-                    emptyCount += 1
-        if emptyCount > 5: # Cierre del socket desde el servidor
-            try:        
-                x = self.sd.sockets[nick]
-                x.shutdown(socket.SHUT_WR)
-                x.close()
-            except Exception:
-                pass
-            finally:
-                x = self.sd.connections[nick]
-                x.close()
-            del self.sd.sockets[nick]
-            del self.sd.connections[nick]
-            raise AssertionError("El socket de %s ha sido cerrado inesperadamente por parte del servidor" % nick)
-        if emptyCount > 0:
-            if emptyCount > 1:
-                logging.debug("AVISO: Recibidas %i líneas en blanco no esperadas por el socket de %s. Puede ser debido a excesivas llamadas a send(), o que el mensaje anterior tiene caracteres de fin de cadena mal formados" % (emptyCount, nick))
-            else:
-                logging.debug("AVISO: Recibida línea en blanco no esperada por el socket de %s. Puede ser debido a excesivas llamadas a send(), o que el mensaje anterior tiene caracteres de fin de cadena mal formados" % nick)
-        return line
+            # El nick de la sesión puede haber cambiado (NICK), así que 
+            # identificamos cada flujo por la clave con la que se conectó
+            porStream = dict((self.sd.connections[nick], nick) for nick in nicks)
+            try:
+                recibido = self.sd.receiver.get(porStream.keys(), restante)
+            except EOFError as e:
+                nick = porStream[e.args[0]]
+                self._closeConnection(nick)
+                raise AssertionError("El socket de %s ha sido cerrado inesperadamente por parte del servidor" % nick)
+            if recibido is None:
+                return
+            
+            stream, entrada = recibido
+            nick = porStream[stream]
+            logging.debug("<< socket de %s dice: %s" % (nick, entrada.line))
+            yield nick, entrada
+    
+    """
+        FUNCIÓN: Cierra y elimina la conexión de un nick tras un cierre por parte del servidor
+    """
+    def _closeConnection(self, nick):
+        try:        
+            x = self.sd.sockets[nick]
+            x.shutdown(socket.SHUT_WR)
+            x.close()
+        except Exception:
+            pass
+        finally:
+            self.sd.receiver.unregister(self.sd.connections[nick])
+        self.sd.sockets.pop(nick, None)
+        del self.sd.connections[nick]
+        self.nicks.discard(nick)
+        self.enviosPendientes.pop(nick, None)
+    
+    """
+        ENTRADA: Lista de nicks, timeout
+        SALIDA: True si el servidor ha respondido al PING de sincronización de todos los nicks
+        FUNCIÓN: Envía por cada nick un PING con un identificador único y descarta 
+             todo lo recibido hasta el PONG correspondiente. El servidor procesa los 
+             comandos de cada cliente en orden, así que al llegar el PONG ya ha 
+             enviado todas las respuestas a los comandos anteriores
+    """
+    def _syncBarrier(self, nicks, timeout = 1):
+        esperas = {}
+        for nick in nicks:
+            token = "R2D2SYNC%s%s" % (next(self.syncIds), self.generateRandomString())
+            self.send(nick, "PING %s" % token, medir = False)
+            esperas[nick] = self.REGEXP_PONG % token
+            
+        try:
+            # Los PING de sincronización no cuentan como latencia de ningún comando
+            Expectation(esperas.items(), Expectation.ALL).wait(self, timeout = timeout, medir = False)
+        except AssertionError:
+            return False
+        return True
+    
+    """
+        ENTRADA: Lista de tuplas (nick, ircReceiver.Received) con las líneas que cumplen
+             una expectativa
+        FUNCIÓN: Anota en el histograma de su comando la latencia de los comandos a los
+             que responden esas líneas. La línea de un nick responde al comando más 
+             antiguo pendiente de ese nick. Si el nick no tiene ninguno, la línea sólo
+             se atribuye a la entrega de un comando de otro nick (COMANDOS_ENTREGA) que
+             esté el primero en su cola y sea el mismo que el de la línea; su latencia
+             llega hasta el último de sus receptores. Si no hay ninguno, no se anota
+    """
+    def _recordLatency(self, llegadas):
+        entregas = {}
+        for nick, entrada in llegadas:
+            cola = self.enviosPendientes.get(nick)
+            if cola:
+                comando, inicio = cola.popleft()
+                self._addLatency(comando, entrada.timestamp - inicio)
+                continue
+            
+            comando = entrada.message['num_command'] if entrada.message is not None else None
+            if comando in self.COMANDOS_ENTREGA:
+                entregas[comando] = max(entrada.timestamp, entregas.get(comando, entrada.timestamp))
+        
+        for comando, llegada in entregas.items():
+            colas = [cola for cola in self.enviosPendientes.values() if cola and cola[0][0] == comando]
+            if colas:
+                cola = min(colas, key = lambda cola: cola[0][1])
+                inicio = cola.popleft()[1]
+                self._addLatency(comando, llegada - inicio)
+    
+    def _addLatency(self, comando, latencia):
+        if comando not in self.latencias:
+            self.latencias[comando] = ircStats.Histogram()
+        self.latencias[comando].add(max(latencia, 0))
     
+    def discardAll (self, nick, timeout = 1):
+        self.discardAllMany([nick], timeout)
+            
     """
-        ENTRADA: Ninguna
+        ENTRADA: Lista de nicks, timeout
         SALIDA: Ninguna
-        FUNCIÓN: Descarta todos los mensajes enviado por el servidor hasta
-             que salta el timeout (significa que no hay más mensajes)
+        FUNCIÓN: Descarta todos los mensajes enviado por el servidor. Si el 
+             servidor responde a PING se usa una barrera de sincronización
+             PING/PONG; si no, se descarta hasta que salta el timeout 
+             (significa que no hay más mensajes)
     """
-    def discardAll (self, nick):
+    def discardAllMany (self, nicks, timeout = 1):
+        
+        nicks = [nick for nick in nicks if nick in self.sd.connections]
+        if len(nicks) == 0:
+            return
+        
+        # Los comandos sin respuesta esperada ya no se pueden medir: se olvidan, para
+        # que no se anoten con la respuesta de otro comando posterior
+        for nick in nicks:
+            self.enviosPendientes.pop(nick, None)
+        
+        # sd.pingBarrier: None si aún no sabemos si el servidor responde a
+        # los PING, True si lo hace y False si no
+        if self.sd.pingBarrier is not False:
+            if self._syncBarrier(nicks, timeout):
+                self.sd.pingBarrier = True
+                return
+            
+            # Si el servidor nunca ha respondido, no lo volvemos a intentar. En
+            # ese caso el timeout ya ha vaciado la cola de recepción
+            if self.sd.pingBarrier is None:
+                logging.debug("AVISO: El servidor no responde al PING de sincronización, se usarán timeouts")
+                self.sd.pingBarrier = False
+            return
         
         #logging.debug ("Vaciando la cola de recepción...")
-        while True:
-            try:
-                line = self._readLine(nick, timeout=1)                
-                
-                assert len(line) != 0
-                
-                #logging.debug("Descartando el mensaje recibido por el socket de %s (%s bytes): %s" % (nick, len(line), line))
-                
-            except AssertionError:
-                break            
+        for nick in nicks:
+            while True:
+                try:
+                    line = self._readLine(nick, timeout=timeout)                
+                    
+                    assert len(line) != 0
+                    
+                    #logging.debug("Descartando el mensaje recibido por el socket de %s (%s bytes): %s" % (nick, len(line), line))
+                    
+                except AssertionError:
+                    break            
     """
         FUNCIÓN: Descarta toda la salida devuelta por el servidor hasta que se 
         encuentra un patrón específico
     """
-    def discardTill (self, nick, regexp):
-        # Leemos la siguiente linea
-        line = self._readLine(nick, regexp)
-        m = re.match(regexp, line)
-        
-        # No, no hay bucles do-while en Python... :/
-        while not m:
-            #logging.debug("Descartando el mensaje recibido por el socket de %s (%s bytes): %s" % (nick, len(line), line))
-            line = self._readLine(nick, regexp)            
-            m = re.match(regexp, line)
-    
-    """
-        ENTRADA: timeout, regexp
-        SALIDA: Lista de comandos IRC
-        FUNCIÓN: Devuelve toda la salida producida por el servidor en forma de lista
-        con cada línea de salida, hasta encontrar un patrón específico
-    """
-#===============================================================================
-#     def readAllLinesTill2 (self, timeout = None, regexp = None):
-#         # Leemos la siguiente linea
-#         listaSalida = []
-#          
-# #===============================================================================
-# #         Hacer una función de lectura que o bien espere que salte
-# # Un timeout, que se reciba un regexp, con un máximo de 
-# # Líneas leidas
-# #===============================================================================
-#          
-#         if timeout is not None:
-#             while True:
-#             try:
-#                 line = self._readLine(nick, timeout=1)
-#                  
-#                 assert len(line) != 0
-#                  
-#             except AssertionError:
-#                 break 
-#      
-#         line = self._readLine(nick, regexp)
-#         m = re.match(regexp, line)
-#         listaSalida.insert(0, line)
-#          
-#         # No, no hay bucles do-while en Python... :/
-#         while not m:
-#             logging.debug("Received message [%s]: %s" % (len(line), line)) 
-#             line = self._readLine(nick, regexp)            
-#             m = re.match(regexp, line)
-#             listaSalida.insert(0, line)
-#          
-#         return listaSalida
-#===============================================================================
-
-    def readAllLinesTill (self, nick, endCommand = ""):
-        
-        receivedMessages = {}                
-        
-        # Recepción y parseo de la respuesta                      
-        #line = self._readLine(nick, timeout = 1)                      
-        line = self._readLine(nick)
-        message = ircparser.translate(line)
-        if message is not None:
-            receivedMessages[message['command']] = line
-        
-        # Si no se especifica un comando de finalización el siguiente bucle
-        # es infinito hasta que salte un timeout. Si se especifica, se para
-        # cuando se encuentra un comando de ese tipo
-        while (endCommand == "" or \
-               ((message is not None) and (message['command'] is not endCommand))):
-            try: 
-                line = self._readLine(nick)
-                message = ircparser.translate(line)
+    def discardTill (self, nick, regexp, timeout = 5):
+        return Expectation([(nick, regexp)]).wait(self, timeout = timeout).match
+            
+    """
+        ENTRADA: Diccionario nick -> expresión regular, timeout total
+        SALIDA: Diccionario nick -> objeto match
+        FUNCIÓN: Versión concurrente de discardTill. Espera a la vez en los sockets
+        de todos los nicks, descartando en cada uno la salida hasta encontrar su patrón
+    """
+    def discardTillMany(self, esperas, timeout = 5):
+        cumplidos = Expectation(esperas.items(), Expectation.ALL).wait(self, timeout = timeout)
+        return dict((c.nick, c.match) for c in cumplidos)
+    
+    """
+        ENTRADA: Diccionario nick -> expresión regular, timeout total
+        SALIDA: Diccionario nick -> objeto match
+        FUNCIÓN: Versión concurrente de expect. La siguiente línea recibida por 
+        cada nick debe encajar con su expresión
+    """
+    def expectMany(self, esperas, timeout = 5):
+        cumplidos = Expectation(esperas.items(), Expectation.ALL, descartar = False).wait(self, timeout = timeout)
+        return dict((c.nick, c.match) for c in cumplidos)
+    
+    """
+        ENTRADA: Mensaje parseado, comando por su nombre, tal cual o como código entero
+        SALIDA: True si el mensaje es de ese comando (comparando por igualdad, no identidad)
+    """
+    @staticmethod
+    def _isCommand(message, comando):
+        if message is None:
+            return False
+        if isinstance(comando, int):
+            return message.code == comando
+        return comando == message['command'] or comando == message['num_command']
+    
+    """
+        ENTRADA: Nick, comando de finalización, número máximo de líneas, timeout total
+        SALIDA: Generador de ircReceiver.Received con cada línea recibida por el nick
+        FUNCIÓN: Lee la salida del servidor línea a línea, según llega. Termina tras 
+             la primera línea del comando endCommand (por nombre, tal cual o código 
+             entero), tras maxLineas líneas o al saltar el timeout. Si no se da ni 
+             endCommand ni maxLineas, se envía un PING de sincronización y se termina 
+             al recibir su PONG (que no se devuelve), ya que para entonces el servidor 
+             ha respondido a todos los comandos anteriores; sólo si el servidor no 
+             responde a los PING se lee hasta el timeout. Lanza AssertionError si el 
+             servidor cierra la conexión
+    """
+    def iterLinesTill(self, nick, endCommand = None, maxLineas = None, timeout = 5):
+        pong = None
+        if not endCommand and maxLineas is None and self.sd.pingBarrier is not False:
+            token = "R2D2SYNC%s%s" % (next(self.syncIds), self.generateRandomString())
+            self.send(nick, "PING %s" % token, medir = False)
+            pong = re.compile(self.REGEXP_PONG % token)
+        
+        leidas = 0
+        try:
+            for n, entrada in self._readMessagesFrom(set([nick]), timeout):
+                if pong is not None and pong.match(entrada.line):
+                    self.sd.pingBarrier = True
+                    pong = None
+                    self._recordLatency([(nick, entrada)])
+                    return
                 
-                # Guardamos el mensaje recibido en el diccionario
-                if message is not None:
-                    receivedMessages[message['command']] = line
-            except AssertionError:
-                break
-        return receivedMessages
+                # La latencia se anota antes de entregar la última línea, porque
+                # el llamante puede dejar de iterar al recibirla
+                leidas += 1
+                ultima = (endCommand and self._isCommand(entrada.message, endCommand)) or \
+                         (maxLineas is not None and leidas >= maxLineas)
+                if ultima:
+                    self._recordLatency([(nick, entrada)])
+                yield entrada
+                if ultima:
+                    return
+            
+            # Ha saltado el timeout sin que llegue el PONG
+            if pong is not None:
+                if self.sd.pingBarrier is None:
+                    logging.debug("AVISO: El servidor no responde al PING de sincronización, se usarán timeouts")
+                    self.sd.pingBarrier = False
+                pong = None
+        finally:
+            # Si se deja de iterar antes del PONG, se descarta hasta él para que no
+            # lo reciba la siguiente lectura
+            if pong is not None and nick in self.sd.connections:
+                try:
+                    Expectation([(nick, pong)]).wait(self, timeout = timeout, medir = False)
+                except AssertionError:
+                    pass
+    
+    """
+        ENTRADA: Nick, comando de finalización, número máximo de líneas, timeout total
+        SALIDA: ReceivedLines con todas las líneas recibidas, en orden
+        FUNCIÓN: Versión de iterLinesTill que devuelve todas las líneas de una vez.
+             Si el servidor cierra la conexión, se devuelve lo recibido hasta entonces
+    """
+    def readAllLinesTill(self, nick, endCommand = None, maxLineas = None, timeout = 5):
+        recibidas = ReceivedLines()
+        try:
+            for entrada in self.iterLinesTill(nick, endCommand, maxLineas, timeout):
+                recibidas.append(entrada)
+        except AssertionError:
+            pass
+        return recibidas
        
-    def expect(self, nick, regexp):          
-        # Leemos la siguiente linea
-        line = self._readLine(nick, regexp)        
-        
-        # Comprobamos la expresión regular
-        m = re.match(regexp, line)
-        assert m is not None, "Los datos recibidos %r no encajan con la expresión requerida %r" % (line, regexp)
-        
-        return m        
+    def expect(self, nick, regexp, timeout = 5):          
+        # La siguiente línea debe encajar con la expresión regular
+        return Expectation([(nick, regexp)], descartar = False).wait(self, timeout = timeout).match
     
     def joinChannel(self, nick, channelName, clave = ""):
         
@@ -278,8 +832,9 @@ class IRCServer(object):
         # Enviamos el mensaje 
         self.send(nickEmisor, r"PRIVMSG #%s :%s" % (canal, mensaje))
         
-        for nick in otrosNicks:              
-            self.discardTill(nick, r":\S+ PRIVMSG #%s :%s" % (canal, mensaje))
+        # Esperamos la entrega en todos los receptores a la vez
+        regexp = r":\S+ PRIVMSG #%s :%s" % (canal, mensaje)
+        self.discardTillMany(dict((nick, regexp) for nick in otrosNicks))
     
     def setChannelTopic(self, nick, channelName, topic):
         
@@ -293,57 +848,59 @@ class IRCServer(object):
         self.discardAll(nick)                
         
     """
-        DEVUELVE: Una lista de tuplas (nombreCanal, numUsuarios, topic)
+        ENTRADA: Nick, comando de las líneas de la respuesta, comando que la termina,
+             función que extrae de los parámetros de cada línea los valores a devolver,
+             timeout total
+        SALIDA: Generador con los valores extraídos de cada línea según llega
+        FUNCIÓN: Recorre una respuesta de varias líneas (LIST, NAMES...) sin guardarla.
+             Lanza AssertionError si salta el timeout antes del final de la respuesta
     """
-    def getChannelList(self, tempNick, includeTopic = False):
-                
-        listaCanales = []
+    def _iterReplies(self, nick, comando, fin, extraer, timeout = 5):
+        for entrada in self.iterLinesTill(nick, fin, timeout = timeout):
+            message = entrada.message
+            if self._isCommand(message, fin):
+                return
+            if self._isCommand(message, comando):
+                for valor in extraer(message['params']):
+                    yield valor
+        
+        raise AssertionError("Se esperaba recibir %s desde el socket de %s, pero ha saltado el timeout" % (fin, nick))
+    
+    """
+        DEVUELVE: Generador con el nombre de cada canal de la respuesta a LIST, o con 
+        tuplas (nombreCanal, numUsuarios, topic) si includeTopic es True
+    """
+    def iterChannelList(self, tempNick, includeTopic = False, timeout = 5):
+        def extraer(params):
+            if len(params) > 2 and params[1].startswith('#'):
+                yield (params[1], params[2], params[3] if len(params) > 3 else "") if includeTopic else params[1]
         
-        # Conexión y envio del comnado                    
         self.send(tempNick, "LIST")
-                          
-        # Recepción y parseo de la respuesta                      
-        leido = self._readLine(tempNick)
-        #assert len(leido) > 0, "Se ha recibido una respuesta vacía al comando LIST"
-        message = ircparser.translate(leido)                                        
-        
-        
-        while (message['command'] is not "RPL_LISTEND"):
-            # Cada mensaje que se muestre en la respuesta suma puntuación                
-            if message['command'] == 'RPL_LIST' and message['params'][1].startswith('#'):
-                listaCanales.append((message['params'][1], 
-                                     message['params'][2], 
-                                     message['params'][3])) if includeTopic == True else listaCanales.append(message['params'][1])
-                
-            # Recepción y parseo de la respuesta                      
-            message = ircparser.translate(self._readLine(tempNick))
+        return self._iterReplies(tempNick, "RPL_LIST", "RPL_LISTEND", extraer, timeout)
+    
+    """
+        DEVUELVE: Una lista de tuplas (nombreCanal, numUsuarios, topic)
+    """
+    def getChannelList(self, tempNick, includeTopic = False):
+        return list(self.iterChannelList(tempNick, includeTopic))
+    
+    """
+        DEVUELVE: Generador con el nick de cada usuario de la respuesta a NAMES de un
+        canal, sin el prefijo de su modo en el canal (@, +...)
+    """
+    def iterChannelUsers(self, nick, nombreCanal, timeout = 5):
+        def extraer(params):
+            for usuario in params[-1].split():
+                yield usuario.lstrip("@+%&~")
         
-        return listaCanales
+        self.send(nick, "NAMES #%s" % nombreCanal)
+        return self._iterReplies(nick, "RPL_NAMREPLY", "RPL_ENDOFNAMES", extraer, timeout)
     
     """
         DEVUELVE: Una lista con los usuarios de un canal dado
     """      
     def getChannelUsers (self, nick, nombreCanal):
-        
-        listaUsuarios = []
-        
-        # Conexión y envio del comnado                    
-        self.send(nick, "NAMES #%s" % nombreCanal)
-                          
-        # Recepción y parseo de la respuesta                      
-        leido = self._readLine(nick)
-        message = ircparser.translate(leido)                                        
-        
-        while (message['command'] is not "RPL_ENDOFNAMES"):
-            # Cada mensaje que se muestre en la respuesta suma puntuación                
-            if message['command'] == 'RPL_NAMREPLY':
-                listaUsuarios.append(message['params'][0])
-                
-            # Recepción y parseo de la respuesta                      
-            leido = self._readLine(nick)
-            message = ircparser.translate(leido)
-        
-        return listaUsuarios
+        return list(self.iterChannelUsers(nick, nombreCanal))
     
     def generateRandomString(self):
         return ''.join(random.sample(string.letters, 8))
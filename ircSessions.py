@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+import logging, threading, collections
+from ircServer import IRCServer, Expectation
+
+"""
+    Vista de ServerDroid para las sesiones de reserva: comparte con él la
+    dirección del servidor, el bucle de recepción y el estado de la barrera
+    PING/PONG, pero guarda sus conexiones en diccionarios propios para que no
+    se mezclen con las de los tests
+"""
+class _PoolDroid(object):
+
+    def __init__(self, sDroid):
+        self.sd = sDroid
+        self.connections = {}
+        self.sockets = {}
+        # Las sesiones de reserva nunca se piden al propio pool
+        self.sessionPool = None
+
+    def __getattr__(self, name):
+        return getattr(self.sd, name)
+
+    @property
+    def pingBarrier(self):
+        return self.sd.pingBarrier
+
+    @pingBarrier.setter
+    def pingBarrier(self, value):
+        self.sd.pingBarrier = value
+
+"""
+    Pool de sesiones ya registradas en el servidor. Cuando un test se conecta
+    con un nick se le entrega, si la hay, una sesión de reserva renombrada con
+    NICK, evitando el registro completo. Al cerrar las conexiones (tearDown) las
+    sesiones vivas se limpian (PART de sus canales, fin de AWAY, nick aleatorio)
+    y vuelven al pool. Un hilo en segundo plano mantiene preparadas las sesiones
+    de reserva mientras se ejecutan los tests. Los tests que comprueban el registro
+    o los datos de USER no usan el pool (IRCTest.sesionesReserva)
+"""
+class SessionPool(object):
+
+    def __init__(self, sDroid, tam = 2):
+        self.sd = sDroid
+        self.droid = _PoolDroid(sDroid)
+        self.tam = tam
+        self.ready = collections.deque()
+        self.cond = threading.Condition()
+        self.thread = None
+        # El pool no prepara sesiones hasta que se le pide la primera
+        self.stopped = True
+        # Se incrementa al vaciar el pool, para descartar sesiones de un servidor anterior
+        self.generacion = 0
+
+    def _run(self):
+        ircServer = IRCServer(self.droid)
+
+        while True:
+            with self.cond:
+                while self.stopped or len(self.ready) >= self.tam:
+                    self.cond.wait()
+                generacion = self.generacion
+
+            nick = ircServer.generateRandomString()
+            try:
+                ircServer.connect(nick)
+            except Exception as e:
+                logging.debug("No se ha podido preparar una sesión de reserva: %s" % e)
+                if nick in self.droid.connections:
+                    ircServer._closeConnection(nick)
+                # No lo volvemos a intentar hasta que se pida otra sesión
+                with self.cond:
+                    self.stopped = True
+                continue
+
+            # A partir de aquí la sesión pertenece al pool, no a este IRCServer
+            ircServer.nicks.discard(nick)
+            with self.cond:
+                if generacion == self.generacion:
+                    self.ready.append(nick)
+                    continue
+            ircServer._closeConnection(nick)
+
+    def _wakeUp(self):
+        with self.cond:
+            self.stopped = False
+            if self.thread is None:
+                self.thread = threading.Thread(target = self._run, name = "SessionPool")
+                self.thread.daemon = True
+                self.thread.start()
+            self.cond.notify_all()
+
+    """
+        ENTRADA: Objeto IRCServer del test, nick solicitado
+        SALIDA: True si se ha entregado una sesión ya registrada con ese nick, False si
+        no hay ninguna disponible y hay que registrar una conexión nueva
+    """
+    def acquire(self, ircServer, nick):
+        with self.cond:
+            reserva = self.ready.popleft() if self.ready else None
+        # Pedimos que se reponga la sesión entregada (o que se empiece a preparar)
+        self._wakeUp()
+        if reserva is None:
+            return False
+
+        self.sd.connections[nick] = self.droid.connections.pop(reserva)
+        self.sd.sockets[nick] = self.droid.sockets.pop(reserva)
+
+        # Renombramos la sesión con el nick pedido
+        try:
+            ircServer.send(nick, "NICK %s" % nick)
+            respuesta = Expectation([r":%s\S* NICK :?%s" % (reserva, nick),
+                                     xrange(400, 500)]).wait(ircServer, [nick])
+        except AssertionError:
+            respuesta = None
+
+        if respuesta is None or respuesta.index != 0:
+            logging.debug("AVISO: No se ha podido renombrar la sesión de reserva %s como %s" % (reserva, nick))
+            if nick in self.sd.connections:
+                ircServer._closeConnection(nick)
+            return False
+
+        logging.debug("Reutilizando la sesión de reserva %s como %s" % (reserva, nick))
+        return True
+
+    """
+        ENTRADA: Objeto IRCServer del test, nick de la conexión
+        SALIDA: True si la sesión se ha limpiado y devuelto al pool, False si debe cerrarse
+        FUNCIÓN: Deshace el estado que ha dejado el test en la sesión (canales, AWAY y
+        nick) y la guarda como sesión de reserva
+    """
+    def release(self, ircServer, nick):
+        stream = self.sd.connections.get(nick)
+        with self.cond:
+            # Se admiten hasta el doble de las sesiones que prepara el hilo, para
+            # no tener que cerrar las que devuelven los tests mientras se repone
+            if stream is None or stream.closed or len(self.ready) >= 2 * self.tam:
+                return False
+            generacion = self.generacion
+
+        # El hilo de recepción actualiza stream.nick en cuanto llega la confirmación
+        actual = stream.nick
+        reserva = ircServer.generateRandomString()
+        # La limpieza no forma parte del test: no se mide su latencia
+        try:
+            for canal in list(stream.channels):
+                ircServer.send(nick, "PART %s" % canal, medir = False)
+            if stream.away:
+                ircServer.send(nick, "AWAY", medir = False)
+            ircServer.send(nick, "NICK %s" % reserva, medir = False)
+            respuesta = Expectation([r":%s\S* NICK :?%s" % (actual, reserva),
+                                     xrange(400, 500)]).wait(ircServer, [nick], medir = False)
+            if respuesta.index != 0:
+                return False
+            ircServer.discardAll(nick)
+        except AssertionError:
+            return False
+
+        # Si el servidor no ha confirmado la limpieza, no reutilizamos la sesión
+        if stream.closed or stream.channels or stream.away:
+            return False
+
+        with self.cond:
+            if generacion != self.generacion:
+                return False
+            self.droid.connections[reserva] = self.sd.connections.pop(nick)
+            self.droid.sockets[reserva] = self.sd.sockets.pop(nick)
+            self.ready.append(reserva)
+        return True
+
+    """
+        FUNCIÓN: Cierra todas las sesiones de reserva (por ejemplo, al cambiar de servidor)
+    """
+    def clear(self):
+        with self.cond:
+            self.generacion += 1
+            self.stopped = True
+            reservas = list(self.ready)
+            self.ready.clear()
+
+        ircServer = IRCServer(self.droid)
+        for reserva in reservas:
+            if reserva in self.droid.connections:
+                ircServer._closeConnection(reserva)
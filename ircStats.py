@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import math, time
+
+"""
+    Reloj monótono para medir latencias, que no salta si se cambia la hora del
+    sistema. Python 2 no tiene time.monotonic, así que se usa clock_gettime a
+    través de ctypes y, si no está disponible, time.time
+"""
+if hasattr(time, "monotonic"):
+    monotonic = time.monotonic
+else:
+    try:
+        import ctypes, ctypes.util
+
+        class _Timespec(ctypes.Structure):
+            _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+        _CLOCK_MONOTONIC = 1
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno = True)
+        _clock_gettime = _libc.clock_gettime
+        _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+        _ts = _Timespec()
+        if _clock_gettime(_CLOCK_MONOTONIC, ctypes.byref(_ts)) != 0:
+            raise OSError(ctypes.get_errno(), "clock_gettime")
+
+        def monotonic():
+            ts = _Timespec()
+            _clock_gettime(_CLOCK_MONOTONIC, ctypes.byref(ts))
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+    except (ImportError, OSError, AttributeError):
+        monotonic = time.time
+
+"""
+    ENTRADA: Lista de valores, percentil (de 0 a 100)
+    SALIDA: Valor del percentil por el método del rango más cercano, o None si no hay valores
+"""
+def percentile(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    i = int(math.ceil(p / 100.0 * len(ordenados))) - 1
+    return ordenados[min(max(i, 0), len(ordenados) - 1)]
+
+def median(valores):
+    return percentile(valores, 50)
+
+# Órdenes de complejidad que distingue fitComplexity
+COMPLEJIDADES = ["O(1)", "O(n)", "O(n²)"]
+
+"""
+    ENTRADA: Valores de x, valores de y
+    SALIDA: Tupla (a, b, error cuadrático) del ajuste por mínimos cuadrados y = a + b·x
+"""
+def _linearFit(xs, ys):
+    n = float(len(xs))
+    mediaX, mediaY = sum(xs) / n, sum(ys) / n
+    varianza = sum((x - mediaX) ** 2 for x in xs)
+    b = sum((x - mediaX) * (y - mediaY) for x, y in zip(xs, ys)) / varianza if varianza else 0.0
+    a = mediaY - b * mediaX
+    return a, b, sum((y - a - b * x) ** 2 for x, y in zip(xs, ys))
+
+"""
+    ENTRADA: Tamaños del problema (N), tiempo medido para cada uno
+    SALIDA: Índice en COMPLEJIDADES del orden de crecimiento que mejor explica los tiempos
+    FUNCIÓN: Ajusta t = a + b·f(N) con f(N) = 1, N y N², y se queda con el modelo más
+         sencillo salvo que uno más complejo reduzca el error a menos de la cuarta
+         parte y prediga que el tiempo al menos crece un 50% en el rango medido (así
+         el ruido de un comando O(1) no se toma por crecimiento)
+"""
+def fitComplexity(tamanos, tiempos):
+    media = sum(tiempos) / float(len(tiempos))
+    orden, error = 0, sum((t - media) ** 2 for t in tiempos)
+    for k in (1, 2):
+        xs = [float(n) ** k for n in tamanos]
+        a, b, errorK = _linearFit(xs, tiempos)
+        if b > 0 and errorK < 0.25 * error and a + b * max(xs) >= 1.5 * (a + b * min(xs)):
+            orden, error = k, errorK
+    return orden
+
+"""
+    ENTRADA: Tamaños del problema (N), tiempo medido para cada uno
+    SALIDA: Pendiente de la recta de regresión de log(t) sobre log(N): el exponente k
+         si los tiempos crecen como N^k
+"""
+def loglogSlope(tamanos, tiempos):
+    puntos = [(math.log(n), math.log(t)) for n, t in zip(tamanos, tiempos) if n > 0 and t > 0]
+    if len(puntos) < 2:
+        return 0.0
+    return _linearFit([x for x, y in puntos], [y for x, y in puntos])[1]
+
+"""
+    Histograma de latencias con cubetas logarítmicas: cada cubeta es un 9% más
+    ancha que la anterior (2^(1/8)), empezando en 1 µs, de modo que ocupa poco
+    sea cual sea el número de medidas y los percentiles se obtienen con un error
+    relativo menor del 9%. Los valores se dan en segundos
+"""
+class Histogram(object):
+
+    MINIMO = 1e-6
+    FACTOR = 2 ** (1 / 8.0)
+
+    def __init__(self):
+        self.cubetas = {}
+        self.cuenta = 0
+        self.total = 0.0
+        self.maximo = None
+
+    def __len__(self):
+        return self.cuenta
+
+    def _index(self, valor):
+        if valor <= self.MINIMO:
+            return 0
+        return int(math.ceil(math.log(valor / self.MINIMO, self.FACTOR)))
+
+    def add(self, valor):
+        i = self._index(valor)
+        self.cubetas[i] = self.cubetas.get(i, 0) + 1
+        self.cuenta += 1
+        self.total += valor
+        if self.maximo is None or valor > self.maximo:
+            self.maximo = valor
+
+    def merge(self, otro):
+        for i, n in otro.cubetas.items():
+            self.cubetas[i] = self.cubetas.get(i, 0) + n
+        self.cuenta += otro.cuenta
+        self.total += otro.total
+        if otro.maximo is not None and (self.maximo is None or otro.maximo > self.maximo):
+            self.maximo = otro.maximo
+
+    def mean(self):
+        return self.total / self.cuenta if self.cuenta else None
+
+    """
+        ENTRADA: Percentil (de 0 a 100)
+        SALIDA: Límite superior de la cubeta en la que cae el percentil (sin pasar
+             del máximo medido), o None si el histograma está vacío
+    """
+    def percentile(self, p):
+        if not self.cuenta:
+            return None
+        rango = max(int(math.ceil(p / 100.0 * self.cuenta)), 1)
+        acumulado = 0
+        for i in sorted(self.cubetas):
+            acumulado += self.cubetas[i]
+            if acumulado >= rango:
+                return min(self.MINIMO * self.FACTOR ** i, self.maximo)
+        return self.maximo
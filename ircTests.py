@@ -8,9 +8,17 @@ from ircServer import IRCServer
 class IRCTest(object):
     __metaclass__ = abc.ABCMeta    
     
+    # Nombres de las clases de los tests que deben pasar antes de ejecutar éste
+    dependencias = []
+    
+    # False si el test comprueba el registro o los datos de USER, de modo que sus 
+    # conexiones deben registrarse con NICK y USER y no salir del pool de reserva
+    sesionesReserva = True
+    
     def __init__(self, sDroid):
         self.sd = sDroid
         self.ircServer = IRCServer(self.sd)
+        self.ircServer.sesionesReserva = self.sesionesReserva
         self.testNick = "yoda"                
         self.testNick2 = "luke"        
         
@@ -19,6 +27,16 @@ class IRCTest(object):
         self.advancedTestsScore = 2
         self.errorTestsScore = 1
         
+    """
+        FUNCIÓN: Sustituye los nicks de prueba por otros únicos (el nick original más un
+        sufijo aleatorio, sin pasar de los 9 caracteres del RFC), para que el test no 
+        interfiera con otros que se ejecuten a la vez sobre el mismo servidor
+    """
+    def useUniqueNicks(self):
+        sufijo = self.ircServer.generateRandomString()[:5]
+        self.testNick = "yoda" + sufijo
+        self.testNick2 = "luke" + sufijo
+        
     @abc.abstractmethod
     def execute(self):
         """ Ejecuta el test """
@@ -44,8 +62,9 @@ class TipoTest:
     BASICO = 'B'
     AVANZADO = 'A'
     ERRORES = 'E'
+    CARGA = 'C'
     
-import basicIRCTests, advancedIRCTests, errorIRCTests
+import basicIRCTests, advancedIRCTests, errorIRCTests, loadIRCTests
 
 basicTestsList = [basicIRCTests.TestConexionRegistro,
                   basicIRCTests.TestComandoJoin,
@@ -75,4 +94,8 @@ errorTestsList = [errorIRCTests.TestAbandonarCanalInexistente,
                      errorIRCTests.TestMensajePrivadoANadie,                     
                      errorIRCTests.TestComandoDesconocido,
                      errorIRCTests.TestComandoWhoisSinNick,
-                     errorIRCTests.TestPruebaEstres]
\ No newline at end of file
+                     errorIRCTests.TestPruebaEstres]
+
+# Las pruebas de carga no puntúan y sólo se ejecutan con --tests carga
+loadTestsList = [loadIRCTests.TestEscalaListNames,
+                 loadIRCTests.TestConsumidorLento]
@@ -1,58 +1,514 @@
 # -*- coding: utf-8 -*-
 
 import re
+import math
+import time
+import errno
+import operator
+import functools
+import itertools
+import contextlib
+import collections
 import socket
 import select
 import threading
 
 import codes
 
-__all__ = ["translate", "Connection"]
+__all__ = ["translate", "translate_lazy", "translate_many", "translate_stream", "encode", "encode_many",
+           "Message", "LazyMessage", "LineBuffer", "Selector", "Connection"]
 
 IRC_RE = re.compile(r"(:(?P<nick>[^ !@]+)(\!(?P<user>[^ @]+))?(\@(?P<host>[^ ]+))? )?(?P<command>[^ ]+) (?P<params1>([^:]*))(?P<params2>(:.*)?)")
 
+class Message(tuple):
+    """ Parsed IRC message.
+
+    A tuple (nick, user, host, command, num_command, params), also readable by
+    attribute, with a read-only dict view (m["params"], m.get("nick"),
+    "host" in m...) offering the keys of the dicts that translate used to
+    return. command is the name from codes.numeric, or 0 if the command is
+    not a known numeric, and num_command is the command as received. """
+
+    __slots__ = ()
+
+    FIELDS = ("nick", "user", "host", "command", "num_command", "params")
+    INDEX = dict((field, i) for i, field in enumerate(FIELDS))
+
+    nick = property(lambda self: tuple.__getitem__(self, 0))
+    user = property(lambda self: tuple.__getitem__(self, 1))
+    host = property(lambda self: tuple.__getitem__(self, 2))
+    command = property(lambda self: tuple.__getitem__(self, 3))
+    num_command = property(lambda self: tuple.__getitem__(self, 4))
+    params = property(lambda self: tuple.__getitem__(self, 5))
+
+    def __new__(cls, nick, user, host, num_command, params):
+        return tuple.__new__(cls, (nick, user, host, codes.numeric.get(num_command, 0), num_command, params))
+
+    @property
+    def prefix(self):
+        """ Message prefix without the leading colon, or None. """
+        if self.nick is None:
+            return None
+        return self.nick + ("!" + self.user if self.user else "") + ("@" + self.host if self.host else "")
+
+    @property
+    def numeric(self):
+        """ True for numeric replies. """
+        return self.command != 0
+
+    @property
+    def code(self):
+        """ Integer code of a numeric reply (see codes.names), or None. """
+        return codes.code(self.num_command)
+
+    def __getitem__(self, key):
+        try:
+            return tuple.__getitem__(self, self.INDEX[key])
+        except (KeyError, TypeError):
+            raise KeyError(key)
+
+    def get(self, key, default = None):
+        i = self.INDEX.get(key)
+        return default if i is None else tuple.__getitem__(self, i)
+
+    def has_key(self, key):
+        return key in self.INDEX
+
+    __contains__ = has_key
+
+    def keys(self):
+        return list(self.FIELDS)
+
+    def items(self):
+        return zip(self.FIELDS, tuple.__iter__(self))
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __eq__(self, other):
+        if isinstance(other, Message):
+            return tuple.__eq__(self, other)
+        try:
+            return all(self[key] == other[key] for key in self.FIELDS)
+        except (KeyError, TypeError):
+            return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "Message(%r)" % dict(self.items())
+
+_new_message = tuple.__new__
+_numeric = codes.numeric.get
+
+def _translate_re(line):
+    """ Slow path: parses with IRC_RE the lines the fast path does not handle. """
+    m = IRC_RE.match(line)
+
+    if not m:
+        return None
+
+    params = m.group("params1").split()
+    if m.group("params2"):  params.append(m.group("params2")[1:])
+
+    return Message(m.group("nick"), m.group("user"), m.group("host"), m.group("command"), params)
+
 def translate(m):
     if isinstance(m, basestring):
         # str -> msg
-        m = IRC_RE.match(m.strip())
+        line = m.strip()
 
-        if not m:
-            return None
+        if line[:1] == ":":
+            start = line.find(" ") + 1
+            if not start:
+                return _translate_re(line)
+            nick = line[1:start - 1]
+            user = host = None
+            # Prefix: nick[!user][@host]. Neither nick nor user can contain
+            # "@", and nick cannot contain "!"
+            if "@" in nick or "!" in nick:
+                nick, at, host = nick.partition("@")
+                nick, bang, user = nick.partition("!")
+                if not nick or (bang and not user) or (at and not host):
+                    return _translate_re(line)
+                user = user or None
+                host = host or None
+            elif not nick:
+                return _translate_re(line)
+        else:
+            start = 0
+            nick = user = host = None
 
-        m = m.groupdict()
-        m["num_command"] = m["command"]
-        m["command"] = codes.numeric[m["command"]] if codes.numeric.has_key(m["command"]) else 0
-        
-        m["params"] = m.pop("params1").split()
-        if m["params2"]:    m["params"] += [m["params2"][1:]]
-        m.pop("params2")
+        end = line.find(" ", start)
+        if end <= start:
+            # IRC_RE requires a space after the command; without it, it would take
+            # the prefix as the command
+            return _translate_re(line)
+        command = line[start:end]
+
+        # As in IRC_RE, the trailing parameter starts at the first colon
+        colon = line.find(":", end)
+        if colon < 0:
+            params = line[end:].split()
+        else:
+            trailing = line[colon + 1:]
+            if "\n" in trailing:
+                return _translate_re(line)
+            params = line[end:colon].split()
+            params.append(trailing)
 
-        return m
+        return _new_message(Message, (nick, user, host, _numeric(command, 0), command, params))
 
     else:
         # msg -> str
-        def gen():
-            if m.get("nick", None):
-                yield ":" + m["nick"]
-                if m.get("user", None):   yield "!" + m["user"]
-                if m.get("host", None):   yield "@" + m["host"]
-                yield " "
+        return _serialize(m)
+
+# Format templates for outgoing messages, one per command and message shape
+_templates = {}
+
+def _template(key):
+    """ Builds (and caches) the format string of a message shape: (command, number
+    of parameters, last one needs a colon), plus (has user, has host) when the
+    message has a prefix. """
+    command, count, colon = key[:3]
+    parts = []
+    if len(key) > 3:
+        parts.append(":%s" + ("!%s" if key[3] else "") + ("@%s" if key[4] else "") + " ")
+    parts.append(command.replace("%", "%%"))
+    if count:
+        parts.append(" %s" * (count - 1) + (" :%s" if colon else " %s"))
+    parts.append("\r\n")
+
+    template = _templates[key] = "".join(parts)
+    return template
+
+def _command(m):
+    """ Command to send for m: the received one for parsed messages. """
+    return m["num_command"] if isinstance(m, (Message, LazyMessage)) else m["command"]
+
+def _serialize(m):
+    """ Message (dict with command and optionally nick, user, host and params)
+    to line, CR/LF included. The trailing parameter only gets a colon if it
+    contains spaces. Message and LazyMessage objects are sent with the command
+    as received (num_command). """
+    get = m.get
+    command = m["command"] if type(m) is dict else _command(m)
+    params = get("params") or ()
+    count = len(params)
+
+    if get("nick"):
+        nick, user, host = m["nick"], get("user"), get("host")
+        key = (command, count, count and " " in params[-1], bool(user), bool(host))
+        args = (nick,) + ((user,) if user else ()) + ((host,) if host else ()) + tuple(params)
+    else:
+        key = (command, count, count and " " in params[-1])
+        args = params if type(params) is tuple else tuple(params)
+
+    template = _templates.get(key)
+    if template is None:
+        template = _template(key)
+    return template % args
+
+def encode(m, out = None):
+    """ Appends the line of message m (as translate would serialize it) to the
+    bytearray out, which is created if not given, and returns it. """
+    if out is None:
+        out = bytearray()
+    out += _serialize(m)
+    return out
+
+def encode_many(messages, out = None):
+    """ Serializes an iterable of messages into a single bytearray, ready for one
+    sendall. Passing the same out between batches (emptied with del out[:])
+    reuses its memory instead of allocating a new buffer each time. """
+    if out is None:
+        out = bytearray()
+    serialize = _serialize
+    for m in messages:
+        out += serialize(m)
+    return out
+
+class LazyMessage(dict):
+    """ IRC message that is only parsed when needed.
+
+    It is a dict created with just the line and the command (command and
+    num_command keys); the first time any other key is read, the whole line
+    is parsed with translate and its fields are stored in the dict itself.
+    Reading the command therefore costs a plain dict lookup. It offers the
+    same attributes and dict view as Message. """
+
+    __slots__ = ()
+
+    def __missing__(self, key):
+        if key not in Message.INDEX:
+            raise KeyError(key)
+        self.update(translate(dict.__getitem__(self, "line")).items())
+        return dict.__getitem__(self, key)
+
+    line = property(lambda self: dict.__getitem__(self, "line"))
+    nick = property(lambda self: self["nick"])
+    user = property(lambda self: self["user"])
+    host = property(lambda self: self["host"])
+    command = property(lambda self: dict.__getitem__(self, "command"))
+    num_command = property(lambda self: dict.__getitem__(self, "num_command"))
+    params = property(lambda self: self["params"])
+    prefix = property(Message.prefix.fget)
+    numeric = property(Message.numeric.fget)
+    code = property(Message.code.fget)
+
+    def get(self, key, default = None):
+        return self[key] if key in Message.INDEX else default
+
+    def has_key(self, key):
+        return key in Message.INDEX
+
+    __contains__ = has_key
+
+    def keys(self):
+        return list(Message.FIELDS)
+
+    def values(self):
+        return [self[key] for key in Message.FIELDS]
+
+    def items(self):
+        return [(key, self[key]) for key in Message.FIELDS]
+
+    def __iter__(self):
+        return iter(Message.FIELDS)
+
+    def __len__(self):
+        return len(Message.FIELDS)
+
+    def __eq__(self, other):
+        try:
+            return all(self[key] == other[key] for key in Message.FIELDS)
+        except (KeyError, TypeError):
+            return False
+
+    def __ne__(self, other):
+        return not self == other
 
-            yield m["command"]            
-            
-            if m.get("params", None):
-                for param in m["params"][:-1]:  yield " " + param
+    def __repr__(self):
+        return "LazyMessage(%r)" % dict.__getitem__(self, "line")
 
-                yield " "
-                if " " in m["params"][-1]:  yield ":"
-                yield m["params"][-1]
+def translate_lazy(line):
+    """ Like translate for a received line, but only extracts the command and
+    returns a LazyMessage. Lines that translate would not parse with its fast
+    path are parsed right away. """
+    line = line.strip()
+    start = 0
 
-            yield "\r\n"
+    if line[:1] == ":":
+        start = line.find(" ") + 1
+        if not start:
+            return translate(line)
+        # Same checks on the prefix as translate, without splitting it
+        at = line.find("@", 1, start - 1)
+        nick_end = at if at >= 0 else start - 1
+        bang = line.find("!", 1, nick_end)
+        if nick_end == 1 or bang == 1 or at == start - 2 or (bang >= 0 and bang == nick_end - 1):
+            return translate(line)
 
-        return "".join(gen())
+    end = line.find(" ", start)
+    if end <= start:
+        return translate(line)
+
+    command = line[start:end]
+    return LazyMessage(line = line, command = _numeric(command, 0), num_command = command)
+
+_is_message = functools.partial(operator.is_not, None)
+
+def translate_many(data, parser = translate):
+    """ Parses a receive buffer (str, bytearray or memoryview) holding many lines.
+
+    Returns a tuple (messages, leftover): an iterator over the messages of all
+    the complete lines, in order, and the trailing incomplete line. The buffer
+    is split in a single pass; blank and unparseable lines are skipped. parser
+    may be translate or translate_lazy. """
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    elif not isinstance(data, str):
+        data = str(data)
+
+    cut = data.rfind("\n") + 1
+    lines = data[:cut].split("\n")
+    lines.pop()
+
+    return itertools.ifilter(_is_message, itertools.imap(parser, lines)), data[cut:]
+
+def translate_stream(chunks, parser = translate):
+    """ Yields the messages of a stream of data chunks, e.g. successive socket
+    reads or the blocks of a trace file:
+
+        translate_stream(iter(lambda: f.read(65536), ""))
+
+    Lines split across chunks are joined; a last line without end of line is
+    also parsed when the stream ends. """
+    leftover = ""
+    for chunk in chunks:
+        messages, leftover = translate_many(leftover + chunk if leftover else chunk, parser)
+        for m in messages:
+            yield m
+
+    if leftover:
+        m = parser(leftover)
+        if m is not None:
+            yield m
+
+class LineBuffer(object):
+    """ Line framing over a preallocated bytearray.
+
+    Data is read straight into the buffer with recv_into, and take() hands out
+    all the complete lines at once, to be parsed with translate_many. The
+    incomplete last line stays in the buffer until the rest arrives. """
+
+    def __init__(self, size = 65536):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0  # first byte not yet handed out
+        self.scan = 0   # first byte not yet searched for "\n"
+        self.end = 0    # end of received data
+
+    def __len__(self):
+        return self.end - self.start
+
+    def _make_room(self):
+        pending = self.end - self.start
+        if self.start == 0:
+            # A single line fills the whole buffer: grow it
+            buf = bytearray(len(self.buf) * 2)
+            buf[:pending] = self.view[:pending].tobytes()
+            self.buf, self.view = buf, memoryview(buf)
+        else:
+            # Move the partial line to the front
+            self.buf[:pending] = self.buf[self.start:self.end]
+            self.scan -= self.start
+            self.start, self.end = 0, pending
+
+    def recv_into(self, sock):
+        """ Reads available data from sock. Returns the number of bytes read (0 on EOF). """
+        if self.start == self.end:
+            self.start = self.scan = self.end = 0
+        elif self.end == len(self.buf):
+            self._make_room()
+
+        n = sock.recv_into(self.view[self.end:])
+        self.end += n
+        return n
+
+    def feed(self, data):
+        """ Appends already received data (for sources other than sockets). """
+        if self.start == self.end:
+            self.start = self.scan = self.end = 0
+        while len(self.buf) - self.end < len(data):
+            self._make_room()
+
+        self.buf[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def take(self):
+        """ Returns, in a single string, all the complete lines in the buffer (up to
+        and including the last "\\n") and removes them from it. Meant to be
+        passed to translate_many. """
+        nl = self.buf.rfind(b"\n", self.scan, self.end)
+        if nl < 0:
+            self.scan = self.end
+            return ""
+
+        data = self.view[self.start:nl + 1].tobytes()
+        self.start = self.scan = nl + 1
+        return data
+
+    def pending(self):
+        """ Returns the incomplete line still in the buffer. """
+        return self.view[self.start:self.end].tobytes()
+
+class Selector(object):
+    """ Waits on many Connections at once.
+
+    Connections created with selector=sel are registered in it; sel.wait()
+    blocks until some of them have messages (or are closed) and reads what
+    they have received, and sel.iter() yields (connection, message) pairs
+    from all of them. Uses poll where available and select otherwise. """
+
+    def __init__(self):
+        self.connections = {}
+        self._poll = select.poll() if hasattr(select, "poll") else None
+
+    def __len__(self):
+        return len(self.connections)
+
+    def register(self, conn):
+        fd = conn.sock.fileno()
+        self.connections[fd] = conn
+        if self._poll is not None:
+            self._poll.register(fd, select.POLLIN)
+
+    def unregister(self, conn):
+        fd = conn.sock.fileno()
+        if self.connections.pop(fd, None) is not None and self._poll is not None:
+            self._poll.unregister(fd)
+
+    def wait(self, timeout = None):
+        """ Returns the connections with messages to read or just closed, waiting
+        at most timeout seconds (forever if None) for one of them. """
+        ready = [conn for conn in self.connections.values() if conn.messages or conn._buffered()]
+        if ready:
+            for conn in ready:
+                if not conn.messages:
+                    conn._fill()
+            return ready
+
+        if self._poll is not None:
+            # poll takes milliseconds: round up, or short timeouts would not wait at all
+            events = self._poll.poll(None if timeout is None else int(math.ceil(timeout * 1000)))
+            fds = [fd for fd, event in events]
+        else:
+            fds = select.select(list(self.connections), [], [], timeout)[0]
+
+        for fd in fds:
+            conn = self.connections.get(fd)
+            if conn is not None:
+                conn._fill()
+                if conn.messages or conn.closed:
+                    ready.append(conn)
+        return ready
+
+    def iter(self, timeout = None):
+        """ Yields (connection, message) for every message received by any
+        connection, and (connection, None) once when one is closed, which is then
+        unregistered. Stops after timeout seconds without messages, or when no
+        connection is left. """
+        while self.connections:
+            ready = self.wait(timeout)
+            if not ready:
+                return
+            for conn in ready:
+                while conn.messages:
+                    yield conn, conn.messages.popleft()
+                if conn.closed:
+                    self.unregister(conn)
+                    yield conn, None
+
+    def __iter__(self):
+        return self.iter()
 
 class Connection(object):
-    def __new__(cls, o, use_ssl = None):
+    """ Client connection to an IRC server.
+
+    Reads go through a LineBuffer and are only done when select/poll reports
+    data, so recv(timeout) returns None once the timeout expires. Messages are
+    parsed a whole receive buffer at a time. Outgoing messages are serialized
+    into a bytearray: inside a batch() block they are only sent, with a single
+    write, when the block ends. use_ssl may be True, for a TLS connection
+    without certificate checks, or an ssl.SSLContext. """
+
+    RECV_SIZE = 16384
+
+    def __new__(cls, o, use_ssl = None, selector = None, parser = None):
         use_ssl = use_ssl if use_ssl is not None else False
 
         if isinstance(o, cls) or o is None:
@@ -65,37 +521,118 @@ class Connection(object):
 
             if use_ssl:
                 import ssl
-                s = ssl.wrap_socket(s)
+                if use_ssl is True:
+                    s = ssl.wrap_socket(s)
+                else:
+                    s = use_ssl.wrap_socket(s, server_hostname = o[0])
 
             s.connect(o)
             o = s
 
         assert isinstance(o, socket.socket)
-        self.s = o
-        self.s_in = self.s.makefile("r")
-        self.s_out = self.s.makefile("w")
+        self.sock = o
+        self.parser = parser or translate
+        self.buffer = LineBuffer(self.RECV_SIZE)
+        self.messages = collections.deque()
+        self.closed = False
+        self.out = bytearray()
+        self.batching = 0
         self.write_lock = threading.Lock()
+        self.selector = selector
+        if selector is not None:
+            selector.register(self)
 
         return self
 
+    def fileno(self):
+        return self.sock.fileno()
+
+    def _buffered(self):
+        """ Bytes already read from the network by the TLS layer, that select
+        does not see. """
+        pending = getattr(self.sock, "pending", None)
+        return pending() if pending is not None else 0
+
+    def _fill(self):
+        """ Reads what the socket has and parses the complete lines. Must only be
+        called when the socket is readable, so that it does not block. """
+        if self.closed:
+            return
+        try:
+            n = self.buffer.recv_into(self.sock)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR) or type(e).__name__ == "SSLWantReadError":
+                return
+            n = 0
+
+        if not n:
+            # EOF: a last line without end of line is also a message
+            self.closed = True
+            m = self.parser(self.buffer.pending())
+            if m is not None:
+                self.messages.append(m)
+            return
+
+        self.messages.extend(translate_many(self.buffer.take(), self.parser)[0])
+
     def _send(self, m):
-        self.s_out.write(translate(m))
-        self.s_out.flush()
+        self.out += _serialize(m)
+        if not self.batching:
+            self._flush()
+
+    def _flush(self):
+        if self.out:
+            data = str(self.out)
+            del self.out[:]
+            self.sock.sendall(data)
 
     def _recv(self, timeout = None):
-        if timeout is not None and self.sock not in select.select([self.sock], [], [], timeout)[0]:
-            return None
+        deadline = None if timeout is None else time.time() + timeout
 
-        m = self.s_in.readline()
-        return translate(m.strip()) if m else None
+        while not self.messages:
+            if self.closed:
+                return None
+            if not self._buffered():
+                remaining = None if deadline is None else max(deadline - time.time(), 0)
+                if not select.select([self.sock], [], [], remaining)[0]:
+                    return None
+            self._fill()
+
+        return self.messages.popleft()
 
     def send(self, **m):
         """ Sends a IRC message. """
         with self.write_lock:
             return self._send(m)
 
+    def send_many(self, messages):
+        """ Sends many IRC messages with a single write. """
+        with self.write_lock:
+            encode_many(messages, self.out)
+            if not self.batching:
+                self._flush()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """ Coalesces the messages sent inside the block into a single write. Blocks
+        can be nested; everything is sent when the outermost one ends. """
+        with self.write_lock:
+            self.batching += 1
+        try:
+            yield self
+        finally:
+            with self.write_lock:
+                self.batching -= 1
+                if not self.batching:
+                    self._flush()
+
+    def flush(self):
+        """ Sends now what has been queued inside a batch() block. """
+        with self.write_lock:
+            self._flush()
+
     def recv(self, timeout = None):
-        """ Receives a parsed IRC message. """
+        """ Receives a parsed IRC message, or None on timeout or end of connection. """
         return self._recv(timeout = timeout)
 
     def iter(self, timeout = None):
@@ -108,8 +645,18 @@ class Connection(object):
     def __iter__(self):
         return self.iter()
 
+    def close(self):
+        if self.selector is not None:
+            self.selector.unregister(self)
+            self.selector = None
+        self.closed = True
+        self.sock.close()
+
     def __getattr__(self, command):
         """ If method is not found, returns a function proxy to send IRC commands. """
+        if command.startswith("_"):
+            raise AttributeError(command)
+
         def command_proxy(*args, **kwargs):
             return self.send(
                 nick = kwargs.get("nick", None),
@@ -120,5 +667,7 @@ class Connection(object):
             )
 
         command_proxy.func_name = command
+        # The next lookups find the proxy in the instance and skip __getattr__
+        self.__dict__[command] = command_proxy
         return command_proxy
 
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+import logging, time, socket, threading
+import ircStats
+from ircTests import IRCTest, TipoTest
+from ircLoad import LoadGenerator
+
+"""
+    Pruebas de carga: miden cómo se comporta el servidor con muchos usuarios,
+    canales o mensajes. No puntúan y no se ejecutan con el resto de pruebas,
+    sólo con --tests carga
+"""
+class LoadTest(IRCTest):
+
+    tipoTest = TipoTest.CARGA
+
+    def getScore(self):
+        return 0
+
+"""
+    Prueba de escala de LIST y NAMES: crea miles de canales repartidos entre
+    muchos usuarios, que además se unen todos a un mismo canal, y mide cuánto
+    tarda en llegar la respuesta completa a LIST y a NAMES de ese canal. Las
+    respuestas se recorren según llegan, comprobando sólo que están todos los
+    canales y usuarios creados
+
+    DEPENDENCIAS: LIST, NAMES
+"""
+class TestEscalaListNames(LoadTest):
+
+    dependencias = ["TestComandoList", "TestComandoNames"]
+
+    numCanales = 10000
+    numUsuarios = 100
+
+    def execute(self):
+        conexiones = self.ircServer.connectBulk(self.numUsuarios)
+        try:
+            # Cada usuario crea su parte de los canales y se une al canal común
+            canalComun = "#" + self.ircServer.generateRandomString()
+            canales = set()
+            asignacion = {}
+            for nick in conexiones:
+                propios = ["#" + self.ircServer.generateRandomString() for i in range(self.numCanales // self.numUsuarios)]
+                canales.update(canal.lower() for canal in propios)
+                asignacion[nick] = propios + [canalComun]
+
+            inicio = time.time()
+            self.ircServer.joinBulk(conexiones, asignacion)
+            logging.info("JOIN: %d canales creados en %.2f s" % (len(canales), time.time() - inicio))
+
+            self.ircServer.connect(self.testNick)
+
+            # LIST: todos los canales creados deben aparecer
+            inicio = time.time()
+            numLineas = 0
+            for canal in self.ircServer.iterChannelList(self.testNick, timeout = 120):
+                canales.discard(canal.lower())
+                numLineas += 1
+            duracion = time.time() - inicio
+            logging.info("LIST: %d canales en %.2f s (%.0f canales/s)" % (numLineas, duracion, numLineas / max(duracion, 1e-6)))
+            assert not canales, "Faltan %d de los canales creados en la respuesta a LIST (por ejemplo, %s)" % \
+                (len(canales), next(iter(canales)))
+
+            # NAMES del canal común: deben estar todos los usuarios
+            usuarios = set(nick.lower() for nick in conexiones)
+            inicio = time.time()
+            for usuario in self.ircServer.iterChannelUsers(self.testNick, canalComun[1:], timeout = 60):
+                usuarios.discard(usuario.lower())
+            logging.info("NAMES: %d usuarios en %.2f s" % (len(conexiones), time.time() - inicio))
+            assert not usuarios, "Faltan %d de los usuarios en la respuesta a NAMES de %s (por ejemplo, %s)" % \
+                (len(usuarios), canalComun, next(iter(usuarios)))
+        finally:
+            self.ircServer.closeBulk(conexiones)
+
+        return self.getScore()
+
+    def getDescription(self):
+        return type(self).__name__ + " - Mide LIST y NAMES con %d canales y %d usuarios" % (self.numCanales, self.numUsuarios)
+
+    def getInfo(self):
+        return """Conecta %d usuarios, que crean entre todos %d canales y se unen a un canal común. Después
+mide el tiempo que tarda el servidor en enviar la respuesta completa a LIST y a NAMES del canal
+común, y comprueba que en ellas aparecen todos los canales y usuarios creados. La prueba no
+puntúa""" % (self.numUsuarios, self.numCanales)
+
+"""
+    Hilo que anota periódicamente la memoria residente (RSS) de un proceso, que
+    obtiene IRCServer.serverProcess (y por tanto sólo existe si está psutil)
+"""
+class _MemorySampler(object):
+
+    def __init__(self, proceso, intervalo = 0.25):
+        self.proceso = proceso
+        self.intervalo = intervalo
+        self.muestras = []
+        self.parar = threading.Event()
+        self.hilo = threading.Thread(target = self._run, name = "Memoria")
+        self.hilo.daemon = True
+
+    def start(self):
+        self.hilo.start()
+
+    def stop(self):
+        self.parar.set()
+        self.hilo.join()
+
+    def _run(self):
+        import psutil
+        while True:
+            try:
+                self.muestras.append((ircStats.monotonic(), self.proceso.memory_info().rss))
+            except psutil.Error:
+                return
+            if self.parar.wait(self.intervalo):
+                return
+
+"""
+    Prueba de un cliente lento: un miembro de un canal deja de leer mientras el
+    resto inundan el canal de mensajes. Un servidor que guarda sin límite lo que
+    no puede enviarle acaba sin memoria; lo correcto es desconectarlo al pasar de
+    cierto límite (SendQ), sin que el resto de clientes lo noten. Se mide la
+    memoria del servidor (con psutil, si se conoce su proceso), si desconecta al
+    cliente lento y la latencia de los demás, con y sin el cliente lento en el
+    canal
+
+    DEPENDENCIAS: PRIVMSG a canal
+"""
+class TestConsumidorLento(LoadTest):
+
+    dependencias = ["TestMensajeACanal"]
+
+    numRapidos = 4
+    tasa = 4000
+    tamano = 450
+    duracionBase = 2
+    # Unos 27 MB de mensajes para el cliente lento, bastante más que el límite de
+    # memoria aunque una parte se quede en los buffers del sistema
+    duracion = 15
+    # Crecimiento de la memoria del servidor que se tolera sin desconectar al cliente lento
+    limiteMemoria = 16 * 1024 * 1024
+
+    def execute(self):
+        rapidos = self.ircServer.connectBulk(self.numRapidos)
+        lento = {}
+        try:
+            lento = self.ircServer.connectBulk(1)
+            nickLento = next(iter(lento))
+            canal = "#" + self.ircServer.generateRandomString()
+            canalesDe = dict((nick, [canal]) for nick in rapidos)
+            self.ircServer.joinBulk(rapidos, canalesDe)
+            # Si el servidor deja de leer a los clientes rápidos, los envíos no deben bloquear la prueba
+            for conn in rapidos.values():
+                conn.sock.settimeout(5)
+
+            proceso = self.ircServer.serverProcess()
+            if proceso is None:
+                logging.info("AVISO: No se encuentra el proceso del servidor o no está instalado psutil, no se medirá su memoria (ver --pid-servidor)")
+
+            generador = LoadGenerator(self.sd, clientes = self.numRapidos, canales = 1, tasa = self.tasa,
+                                      tamano = self.tamano, duracion = self.duracionBase, privados = 0)
+            base = self._generate(generador, rapidos, canalesDe)
+
+            # A partir de aquí el cliente lento no vuelve a leer
+            self.ircServer.joinBulk(lento, {nickLento: [canal]})
+            caida = []
+            def observador(conn, message):
+                if message.num_command == "QUIT" and (message.nick or "").lower() == nickLento.lower():
+                    caida.append(ircStats.monotonic())
+
+            muestreo = _MemorySampler(proceso) if proceso is not None else None
+            if muestreo is not None:
+                muestreo.start()
+            generador.duracion = self.duracion
+            inicio = ircStats.monotonic()
+            try:
+                carga = self._generate(generador, rapidos, canalesDe, observador)
+            finally:
+                if muestreo is not None:
+                    muestreo.stop()
+            desconectado = bool(caida) or self._isDisconnected(lento[nickLento])
+        finally:
+            self.ircServer.closeBulk(rapidos)
+            self.ircServer.closeBulk(lento)
+
+        latenciasBase, latencias = base["latenciasCanal"], carga["latenciasCanal"]
+        if latenciasBase and latencias:
+            logging.info("Latencia de los clientes rápidos: p50 %.2f ms, p95 %.2f ms sin el cliente lento; p50 %.2f ms, p95 %.2f ms con él" % \
+                tuple(ircStats.percentile(valores, p) * 1000 for valores in (latenciasBase, latencias) for p in (50, 95)))
+        if caida:
+            logging.info("Cliente lento desconectado a los %.1f s, tras unos %.1f MB de mensajes" % \
+                (caida[0] - inicio, (caida[0] - inicio) * self.tasa * self.tamano / 2.0 ** 20))
+        else:
+            logging.info("Cliente lento %s" % ("desconectado al terminar" if desconectado else "no desconectado"))
+
+        crecimiento = 0
+        if muestreo is not None and muestreo.muestras:
+            memoria = [rss for instante, rss in muestreo.muestras]
+            crecimiento = max(memoria) - memoria[0]
+            logging.info("Memoria del servidor: %.1f MB al empezar, %.1f MB como máximo (+%.1f MB)" % \
+                (memoria[0] / 2.0 ** 20, max(memoria) / 2.0 ** 20, crecimiento / 2.0 ** 20))
+
+        assert desconectado or crecimiento <= self.limiteMemoria, \
+            "El servidor ha crecido %.1f MB guardando mensajes para un cliente que no lee, sin desconectarlo" % \
+            (crecimiento / 2.0 ** 20)
+        perdidas = carga["esperadas"] - carga["recibidas"]
+        assert not perdidas, "Los clientes rápidos han dejado de recibir %d de %d mensajes mientras un miembro del canal no leía" % \
+            (perdidas, carga["esperadas"])
+
+        return self.getScore()
+
+    def _generate(self, generador, conexiones, canalesDe, observador = None):
+        try:
+            return generador.generate(conexiones, canalesDe, observador)
+        except socket.error as e:
+            raise AssertionError("No se ha podido enviar a los clientes rápidos (%s): el servidor ha dejado de leerlos" % e)
+
+    """
+        ENTRADA: Conexión del cliente lento
+        SALIDA: True si el servidor la ha cerrado o le ha enviado ERROR
+        FUNCIÓN: Lee todo lo que el servidor tiene pendiente para el cliente lento,
+             durante un máximo de 10 segundos
+    """
+    def _isDisconnected(self, conn):
+        limite = ircStats.monotonic() + 10
+        while ircStats.monotonic() < limite:
+            if not conn.selector.wait(1):
+                return False
+            while conn.messages:
+                if conn.messages.popleft().num_command == "ERROR":
+                    return True
+            if conn.closed:
+                return True
+        return False
+
+    def getDescription(self):
+        return type(self).__name__ + " - Comprueba cómo trata el servidor a un cliente que no lee"
+
+    def getInfo(self):
+        return """Une %d clientes a un canal y los hace enviar %d mensajes por segundo de %d bytes, primero
+durante %d s y después otros %d s con un miembro más que nunca lee. Mide la latencia de
+los clientes que sí leen en los dos casos, si el servidor desconecta al que no lee y cuánto
+crece la memoria del servidor. La prueba falla si los demás clientes pierden mensajes o si
+el servidor crece más de %d MB sin desconectar al cliente lento. La prueba no puntúa""" % \
+            (self.numRapidos, self.tasa, self.tamano, self.duracionBase, self.duracion, self.limiteMemoria // 2 ** 20)
@@ -3,7 +3,11 @@
 """R2D2 - Redes 2 Droid 2.0 - Universidad Autónoma de Madrid
 
 Usage:
-  r2d2 [--verbose] [--servidor <IP_servidor>] [--puerto <puerto_servidor>] [--tests <rango_tests>]  
+  r2d2 [--verbose] [--servidor <IP_servidor>] [--puerto <puerto_servidor>] [--tests <rango_tests>] [--paralelo <num_hilos>] [--latencias] [--pid-servidor <pid>]
+  r2d2 [--verbose] [--servidor <IP_servidor>] [--puerto <puerto_servidor>] --perfil <comandos> [--perfil-max <n>] [--perfil-max-miembros <n>]
+  r2d2 [--verbose] [--servidor <IP_servidor>] [--puerto <puerto_servidor>] --carga [--carga-clientes <n>] [--carga-canales <n>] [--carga-tasa <msg/s>] [--carga-tamano <bytes>] [--carga-duracion <s>] [--carga-privados <fraccion>]
+  r2d2 [--verbose] [--servidor <IP_servidor>] [--puerto <puerto_servidor>] --tormenta <conexiones> [--tormenta-ritmo <conexiones/s>]
+  r2d2 [--verbose] [--servidor <IP_servidor>] [--puerto <puerto_servidor>] --difusion <k_max>
   r2d2 [--lista-tests]
   r2d2 [--info-test <numero_test>]  
   r2d2 [--version]      
@@ -18,15 +22,37 @@ Opciones:
   --servidor <IP_servidor>      Dirección IP del servidor IRC
   --puerto <puerto_servidor>    Puerto del servicio IRC del servidor
   --lista-tests                 Muestra una lista completa de todas las pruebas disponibles
-  --tests <rango_tests>         Selecciona los tests a realizar. Las opciones son 'basicos', 'adv', 'errores' o uno o varios rangos númericos separados por comas
+  --tests <rango_tests>         Selecciona los tests a realizar. Las opciones son 'basicos', 'adv', 'errores', 'carga' o uno o varios rangos númericos separados por comas
   --info-test <numero_test>     Muestra información detallada sobre una prueba concreta
+  --paralelo <num_hilos>        Ejecuta las pruebas en paralelo con el número de hilos indicado, cada una con nicks propios [default: 1]
+  --latencias                   Muestra al terminar la latencia de cada comando y de cada prueba (p50, p95, p99 y máximo), desde que se envía el comando hasta que llega la respuesta esperada
+  --pid-servidor <pid>          PID del servidor, para medir su memoria en las pruebas de carga (si no se indica, se busca el proceso local que escucha en el puerto)
+  --perfil <comandos>           Mide cómo crece la latencia de los comandos con el tamaño del servidor (N canales, usuarios o miembros de un canal). Los comandos son JOIN, LIST, NAMES, WHOIS y PRIVMSG, separados por comas, o 'todos'
+  --perfil-max <n>              Tamaño máximo del servidor en el perfil [default: 10000]
+  --perfil-max-miembros <n>     Número máximo de miembros de un canal en el perfil de NAMES y PRIVMSG [default: 1000]
+  --carga                       Genera carga de PRIVMSG sobre el servidor y mide el ritmo de entrega y la latencia
+  --carga-clientes <n>          Número de clientes conectados a la vez [default: 100]
+  --carga-canales <n>           Número de canales entre los que se reparten los clientes [default: 10]
+  --carga-tasa <msg/s>          Mensajes por segundo que se intentan enviar [default: 1000]
+  --carga-tamano <bytes>        Tamaño del texto de cada mensaje [default: 64]
+  --carga-duracion <s>          Segundos durante los que se envían mensajes [default: 10]
+  --carga-privados <fraccion>   Fracción de mensajes privados; el resto van a canales [default: 0.5]
+  --tormenta <conexiones>       Abre a la vez el número de conexiones indicado, registrando un nick en cada una, y mide el tiempo hasta RPL_WELCOME y los fallos
+  --tormenta-ritmo <conexiones/s>  Abre las conexiones de la tormenta a este ritmo en lugar de todas a la vez (0: todas a la vez) [default: 0]
+  --difusion <k_max>            Mide la latencia de entrega de un mensaje a un canal con K miembros, con K creciendo de 1 a k_max
   --corrector <dir>
 """
 
 import sys, docopt, logging
+import ircStats
 from termcolor import colored
 from ircTests import TipoTest
 import ircTests, corrector
+from ircReceiver import Receiver
+from ircSessions import SessionPool
+from ircScheduler import TestScheduler
+from ircProfiler import ComplexityProfiler
+from ircLoad import LoadGenerator, ConnectionStorm, FanOutBenchmark
 
 DEFAULT_SERVER_IP = '127.0.0.1'
 DEFAULT_SERVER_PORT = 6667
@@ -37,12 +63,23 @@ class ServerDroid(object):
         # Valores por defecto
         self.serverIP = DEFAULT_SERVER_IP
         self.serverPort = DEFAULT_SERVER_PORT                
+        # PID del proceso servidor, si se conoce
+        self.serverPid = None
         self.connections = {}
         self.sockets = {}
+        # Bucle de recepción común a todas las conexiones
+        self.receiver = Receiver()
+        # ¿Responde el servidor a los PING de sincronización? (None: no se sabe aún)
+        self.pingBarrier = None
+        # Sesiones ya registradas que se reutilizan entre tests
+        self.sessionPool = SessionPool(self)
         self.testsList = []
         self.basicTestsList = []
         self.advancedTestsList = []
         self.errorTestsList = []
+        self.loadTestsList = []
+        # ¿Se muestran las latencias de los comandos al terminar las pruebas?
+        self.mostrarLatencias = False
         
         self.initTests()
         
@@ -57,6 +94,8 @@ class ServerDroid(object):
             self.advancedTestsList.append(obj(self))
         for obj in ircTests.errorTestsList:
             self.errorTestsList.append(obj(self))
+        for obj in ircTests.loadTestsList:
+            self.loadTestsList.append(obj(self))
             
         # Lista completa
         self.testsList = self.basicTestsList + self.advancedTestsList + self.errorTestsList               
@@ -96,6 +135,12 @@ class ServerDroid(object):
             print colored ("[%s] - %s" % (numTest, test.getDescription()), 'yellow')
             numTest += 1
             
+        print
+        print ("Pruebas de carga (sólo con --tests carga)")
+        
+        for test in self.loadTestsList:
+            print colored ("[carga] - %s" % test.getDescription(), 'yellow')
+            
     """
         FUNC: Muestra información extendida sobre un test concreto.
         RECIBE: Número del test en la lista completa de tests
@@ -122,31 +167,75 @@ class ServerDroid(object):
     def launchAllTests(self):        
         return self.launchCustomTests(self.testsList)
         
+    """
+        FUNCIÓN: Ejecuta un test
+        RECIBE: Objeto test, y si hay que cerrar sus conexiones al terminar
+        DEVUELVE: Tupla (puntuación, AssertionError o None si el test ha ido bien)
+    """
+    def executeTest(self, test, cerrar = False):
+        test.ircServer.latencias.clear()
+        test.ircServer.enviosPendientes.clear()
+        try:
+            # Señalizamos el inicio y fin de la prueba
+            logging.debug("========== INICIO %s =============" % type(test).__name__)
+            score = test.execute()                    
+            logging.debug("========== FIN %s =============" % type(test).__name__)
+            return score, None
+        except AssertionError as ae:
+            return 0, ae
+        finally:
+            if cerrar:
+                test.ircServer.tearDown()
+    
+    """
+        FUNCIÓN: Ejecuta los tests según sus dependencias (ver ircScheduler), en paralelo
+        si se indica más de un hilo. Cada test en paralelo usa nicks propios y cierra sus
+        conexiones al terminar
+        RECIBE: Lista con los objetos tests, número de hilos
+        DEVUELVE: Generador con el resultado de executeTest de cada test, en el orden de
+        la lista. Si un test lanza una excepción distinta de AssertionError, se relanza
+    """
+    def executeTests(self, listaTests, numHilos = 1):
+        paralelo = numHilos > 1
+        if paralelo:
+            for test in listaTests:
+                test.useUniqueNicks()
+        
+        planificador = TestScheduler(listaTests, lambda test: self.executeTest(test, cerrar = paralelo), numHilos)
+        return planificador.run()
+        
     """
         FUNCIÓN: Función que lanza los tests solicitados
-        RECIBE: Lista con los objetos tests que deben ser lanzados
+        RECIBE: Lista con los objetos tests que deben ser lanzados, número de hilos
         DEVUELVE: -
     """
-    def launchCustomTests(self, listaTests):
+    def launchCustomTests(self, listaTests, numHilos = 1):
         
         print colored(BANNER, 'red')
         print                
         print ("Lanzando pruebas...")                                        
         
+        # Cada servidor puede responder o no a los PING de sincronización
+        self.pingBarrier = None
+        self.sessionPool.clear()
+        # Cada hilo puede liberar dos sesiones a la vez
+        self.sessionPool.tam = 2 * max(numHilos, 1)
+        
         try: 
             totalScore = numCorrectos = numIncorrectos = score = 0
             i = 1
             testEmpaquetadoEjecutado = testEmpaquetadoErroneo = False
             numTests = len(listaTests)
+            resultados = self.executeTests(listaTests, numHilos)
                         
             # Lanzamos cada test...    
             for test in listaTests:
                 try:
                     print ((" %s/%s - %s" % (i, numTests, type(test).__name__)).ljust(50, '.')),
-                    # Señalizamos el inicio y fin de la prueba
-                    logging.debug("========== INICIO %s =============" % type(test).__name__)
-                    score = test.execute()                    
-                    logging.debug("========== FIN %s =============" % type(test).__name__)
+                    sys.stdout.flush()
+                    score, ae = next(resultados)
+                    if ae is not None:
+                        raise ae
                     
                     # Si no se ha producido ninguna excepción, el test ha ido bien
                     print colored('[CORRECTA] [%.2f] [%s]' % (score, test.tipoTest), 'green') 
@@ -194,9 +283,41 @@ class ServerDroid(object):
                 print colored("""\nATENCIÓN: La práctica no ha pasado la prueba de empaquetado, por lo que
 ésta no puede ser entregada ni evaluada""", 'red')
                 
+            if self.mostrarLatencias:
+                self.showLatencyReport(listaTests)
+                
             # Devolvemos una tupla de resultados
             return totalScore, "%s/%s" % (numCorrectos, len(listaTests)), testEmpaquetadoErroneo
     
+    def _latencyRow(self, nombre, histograma):
+        return "%-32s %8d %10.2f %10.2f %10.2f %10.2f" % ((nombre, len(histograma)) +
+            tuple(histograma.percentile(p) * 1000 for p in (50, 95, 99, 100)))
+    
+    """
+        FUNCIÓN: Muestra las latencias medidas durante las pruebas, por prueba y por
+        comando, a partir de los histogramas de cada IRCServer
+        RECIBE: Lista con los objetos tests ejecutados
+        DEVUELVE: -
+    """
+    def showLatencyReport(self, listaTests):
+        cabecera = "%-32s %8s %10s %10s %10s %10s" % ("", "medidas", "p50 (ms)", "p95 (ms)", "p99 (ms)", "max (ms)")
+        porComando = {}
+        print "\nLatencias"
+        print "---------\n"
+        print cabecera.replace(" " * 6, "Prueba", 1)
+        for test in listaTests:
+            total = ircStats.Histogram()
+            for comando, histograma in test.ircServer.latencias.items():
+                total.merge(histograma)
+                porComando.setdefault(comando, ircStats.Histogram()).merge(histograma)
+            if len(total):
+                print self._latencyRow(type(test).__name__, total)
+        
+        print
+        print cabecera.replace(" " * 7, "Comando", 1)
+        for comando in sorted(porComando):
+            print self._latencyRow(comando, porComando[comando])
+        print
         
 if __name__ == "__main__":
     
@@ -241,6 +362,45 @@ if __name__ == "__main__":
         sd.serverIP = arguments['--servidor']
     if (arguments['--puerto'] is not None):     
         sd.serverPort = int(arguments['--puerto'])
+    if (arguments['--pid-servidor'] is not None):
+        sd.serverPid = int(arguments['--pid-servidor'])
+        
+    # Se solicita el perfil de complejidad de los comandos
+    if (arguments['--perfil'] is not None):
+        comandos = arguments['--perfil'].upper()
+        comandos = ComplexityProfiler.COMANDOS if comandos == 'TODOS' else [c.strip() for c in comandos.split(",")]
+        desconocidos = [c for c in comandos if c not in ComplexityProfiler.COMANDOS]
+        if desconocidos:
+            raise docopt.DocoptExit("ERROR: Comando desconocido en --perfil: %s (se admiten %s o 'todos')" % \
+                                    (", ".join(desconocidos), ", ".join(ComplexityProfiler.COMANDOS)))
+        print colored(BANNER, 'red')
+        print
+        ComplexityProfiler(sd, nMax = int(arguments['--perfil-max']), 
+                           maxMiembros = int(arguments['--perfil-max-miembros'])).run(comandos)
+        sys.exit()
+        
+    # Se solicita la generación de carga
+    if (arguments['--carga'] is True):
+        print colored(BANNER, 'red')
+        print
+        LoadGenerator(sd, clientes = int(arguments['--carga-clientes']), canales = int(arguments['--carga-canales']),
+                      tasa = float(arguments['--carga-tasa']), tamano = int(arguments['--carga-tamano']),
+                      duracion = float(arguments['--carga-duracion']), privados = float(arguments['--carga-privados'])).run()
+        sys.exit()
+        
+    # Se solicita la tormenta de conexiones
+    if (arguments['--tormenta'] is not None):
+        print colored(BANNER, 'red')
+        print
+        ConnectionStorm(sd, conexiones = int(arguments['--tormenta']), ritmo = float(arguments['--tormenta-ritmo'])).run()
+        sys.exit()
+        
+    # Se solicita la prueba de difusión en un canal
+    if (arguments['--difusion'] is not None):
+        print colored(BANNER, 'red')
+        print
+        FanOutBenchmark(sd, kMax = int(arguments['--difusion'])).run()
+        sys.exit()
         
     if (arguments['--tests'] is not None):
         # ¿Se pide un test concreto?
@@ -252,13 +412,17 @@ if __name__ == "__main__":
             listaTests = sd.advancedTestsList
         elif seleccion == 'errores':
             listaTests = sd.errorTestsList
+        elif seleccion == 'carga':
+            listaTests = sd.loadTestsList
         else:
             rangos = (x.split("-") for x in seleccion.split(","))
             # Generemos una lista con los números de los tests seleccionados
             listaTests = [sd.testsList[i] for r in rangos for i in range(int(r[0]), int(r[-1]) + 1)]        
     
+    sd.mostrarLatencias = arguments['--latencias'] is True
+    
     # Si listaTests es vacía, se ejecutarán todos los tests
-    sd.launchCustomTests(listaTests)        
+    sd.launchCustomTests(listaTests, int(arguments['--paralelo']))        
 
     
     